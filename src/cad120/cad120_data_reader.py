@@ -17,6 +17,7 @@ import csv
 import argparse
 import sys
 import os
+import copy
 import numpy as np
 from qsrlib_io.world_trace import *
 
@@ -34,6 +35,11 @@ class CAD120_Data_Reader(object):
         self.load_from_files = load_from_files
         self.read_tracks = read_tracks
 
+        # columnar skeleton tracks, see make_skeleton_columns
+        self.skeleton_tracks = {}
+        self.skeleton_states = {}
+        self.skeleton_tracks_stale = set()
+
         config_parser = ConfigParser.SafeConfigParser()
         if len(config_parser.read(config_filename)) == 0:
             raise ValueError("Config file not found, please provide a config.ini file as described in the documentation")
@@ -552,6 +558,7 @@ class CAD120_Data_Reader(object):
         if self.read_tracks:
             filename = self.ground_truth_tracks_filename
             print("tracks to " + filename)
+            self.sync_world_traces()
             with open(filename, "wb") as f:
                 pickle.dump(self.world_traces, f)
         else:
@@ -575,6 +582,7 @@ class CAD120_Data_Reader(object):
         return subject_name, super_name, video_name
 
     def world_skeleton_trace_to_dict(self, id):
+        self.sync_world_traces([id])
         world_trace = self.world_traces[id]
         sorted_timestamps = world_trace.get_sorted_timestamps()
         ret = {}
@@ -603,6 +611,100 @@ class CAD120_Data_Reader(object):
             ret[id] = self.world_skeleton_trace_to_dict(id)
         return ret
 
+    def make_skeleton_columns(self, ids=None):
+        """
+        Columnar storage of the skeleton tracks: self.skeleton_tracks[id][joint] is a (T, 2) array over the sorted
+        timestamps. The Object_State of every joint and frame is kept so that arrays can be written back to the world
+        traces in bulk. Missing joints are filled from the previous frame as in world_skeleton_trace_to_dict, or from
+        the first frame with the joint for the frames before it, with a copy of that state so that every frame owns
+        its own state. Note that the copies are inserted in the world states, so that the written back values of the
+        filled frames land in the world traces too.
+
+        :param ids: episodes to make, all if None
+        """
+        if ids is None:
+            ids = self.world_traces.keys()
+        for id in ids:
+            world_trace = self.world_traces[id]
+            sorted_timestamps = world_trace.get_sorted_timestamps()
+            states = {}
+            for s in self.skeleton_pass_filter:
+                states[s] = []
+            # the first state of every joint, to fill the frames before it
+            first_states = {}
+            for t in sorted_timestamps:
+                for s in self.skeleton_pass_filter:
+                    if s not in first_states and s in world_trace.trace[t].objects:
+                        first_states[s] = world_trace.trace[t].objects[s]
+            missing = [s for s in self.skeleton_pass_filter if s not in first_states]
+            if sorted_timestamps and missing:
+                raise ValueError("episode %s has no frame with the joints %s" % (id, missing))
+            for i in range(len(sorted_timestamps)):
+                world_state = world_trace.trace[sorted_timestamps[i]]
+                for s in self.skeleton_pass_filter:
+                    try:
+                        s_state = world_state.objects[s]
+                    except KeyError:
+                        s_state = None
+                    if s_state is None or (i > 0 and s_state is states[s][-1]):
+                        s_state = copy.copy(states[s][-1] if states[s] else first_states[s])
+                        world_state.objects[s] = s_state
+                    states[s].append(s_state)
+            self.skeleton_states[id] = states
+            self.skeleton_tracks[id] = {}
+            for s, s_states in states.items():
+                self.skeleton_tracks[id][s] = np.array([(o.x, o.y) for o in s_states], dtype=float).reshape(-1, 2)
+        self.skeleton_tracks_stale.difference_update(ids)
+
+    def skeleton_tracks_to_array(self, id, joints=None):
+        """
+        :param id: episode
+        :param joints: joints in the order of the J axis, self.skeleton_pass_filter if None
+        :return: (T, J, 2) array from the columnar storage
+        """
+        if id not in self.skeleton_tracks:
+            self.make_skeleton_columns([id])
+        if joints is None:
+            joints = self.skeleton_pass_filter
+        return np.concatenate([self.skeleton_tracks[id][j][:, None] for j in joints], axis=1)
+
+    def set_skeleton_tracks(self, id, tracks, joints=None, sync=True):
+        """
+        Bulk write-back of a (T, J, 2) array to an episode. The columnar storage just takes references to the columns
+        of tracks; the Object_States of the world trace are updated now if sync is True, otherwise on sync_world_traces,
+        which save, world_skeleton_trace_to_dict and CAD120_QSR_Keeper.make call before reading the world traces.
+
+        :param id: episode
+        :param tracks: (T, J, 2) array over the sorted timestamps
+        :param joints: joints of the J axis, self.skeleton_pass_filter if None
+        :param sync: also update the world trace now
+        """
+        if id not in self.skeleton_tracks:
+            self.make_skeleton_columns([id])
+        if joints is None:
+            joints = self.skeleton_pass_filter
+        if len(tracks) != len(self.skeleton_states[id][joints[0]]):
+            raise ValueError(id, "len(sorted_timestamps, tracks):", len(self.skeleton_states[id][joints[0]]), len(tracks))
+        for i, j in enumerate(joints):
+            self.skeleton_tracks[id][j] = tracks[:, i]
+        self.skeleton_tracks_stale.add(id)
+        if sync:
+            self.sync_world_traces([id])
+
+    def sync_world_traces(self, ids=None):
+        """
+        Writes the columnar skeleton tracks that changed since the last sync to the Object_States of the world traces.
+
+        :param ids: episodes to sync, all the stale ones if None
+        """
+        ids = list(self.skeleton_tracks_stale) if ids is None else [id for id in ids if id in self.skeleton_tracks_stale]
+        for id in ids:
+            for j, track in self.skeleton_tracks[id].items():
+                for o, (x, y) in zip(self.skeleton_states[id][j], track.tolist()):
+                    o.x = x
+                    o.y = y
+            self.skeleton_tracks_stale.discard(id)
+
 class attrdict(dict):
     """ Dictionary with attribute like access """
     def __init__(self, *args, **kwargs):
@@ -12,12 +12,16 @@ import argparse
 import timeit
 import ConfigParser
 import os
+import itertools
+import datetime
+import numpy as np
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 from cad120_data_reader import CAD120_Data_Reader
-from qsrlib.qsrlib import QSRlib, QSRlib_Request_Message
+from qsrlib.qsrlib import QSRlib, QSRlib_Request_Message, QSRlib_Response_Message
+from utilities import qsr_fast_path
 
 
 class CAD120_QSR_Keeper(object):
@@ -50,16 +54,65 @@ class CAD120_QSR_Keeper(object):
         stop = timeit.default_timer()
         print("QSRs generated in: %.2f secs" % (stop - start))
 
-    def make(self, qsrlib=None):
+    def make(self, qsrlib=None, fast_path=True):
+        """
+        world_qsr_traces[k] is the QSRlib_Response_Message of episode k on both paths, its qsrs the World_QSR_Trace.
+
+        :param fast_path: compute rcc3_rectangle_bounding_boxes_2d with qsr_fast_path instead of QSRlib, see
+        rcc3_fast_path; the other QSRs always go through QSRlib
+        """
         if qsrlib:
             self.qsrlib = qsrlib
         if self.qsrlib is None:
             raise TypeError("Pass a QSRlib object")
+        # skeleton tracks written back to the reader's columnar storage only, e.g. by CAD120_Tracks_Filters
+        self.reader.sync_world_traces()
         for k, world_trace in zip(self.reader.world_traces.keys(), self.reader.world_traces.values()):
+            if fast_path and self.which_qsr == "rcc3_rectangle_bounding_boxes_2d":
+                requested = datetime.datetime.now()
+                qsrs = self.rcc3_fast_path(world_trace)
+                self.world_qsr_traces[k] = QSRlib_Response_Message(qsrs=qsrs, timestamp_request_made=requested,
+                                                                   timestamp_request_received=requested,
+                                                                   timestamp_qsrs_computed=datetime.datetime.now())
+                continue
             request_message = QSRlib_Request_Message(which_qsr=self.which_qsr, input_data=world_trace, include_missing_data=True)
             # out = self.qsrlib.request_qsrs(request_message=request_message)
             self.world_qsr_traces[k] = self.qsrlib.request_qsrs(request_message=request_message)
 
+    def rcc3_fast_path(self, world_trace):
+        """
+        The RCC3 of every pair of objects of a world trace, as QSRlib computes them, from arrays of their bounding
+        boxes. The pairs of an object without a size in some frame, such as the joints, are left to QSRlib.
+        """
+        timestamps = world_trace.get_sorted_timestamps()
+        names = sorted(set(name for state in world_trace.trace.values() for name in state.objects))
+        index = dict((name, i) for i, name in enumerate(names))
+        centres = np.full((4, len(names), len(timestamps)), np.nan)
+        present = np.zeros((len(names), len(timestamps)), dtype=bool)
+        for j, t in enumerate(timestamps):
+            for name, object_state in world_trace.trace[t].objects.items():
+                i = index[name]
+                centres[:, i, j] = (object_state.x, object_state.y, object_state.width, object_state.length)
+                present[i, j] = True
+        boxes = qsr_fast_path.boxes_from_centres(*centres)
+        sized = np.all(np.isfinite(boxes).all(axis=-1) | ~present, axis=1)
+        pairs = list(itertools.combinations(range(len(names)), 2))
+        fast_pairs = [(i, j) for i, j in pairs if sized[i] and sized[j]]
+        first, second = [i for i, _ in fast_pairs], [j for _, j in fast_pairs]
+        codes, strings = qsr_fast_path.rcc3_rectangle_bounding_boxes_2d(boxes[first], boxes[second])
+        codes = np.where(present[first] & present[second], codes, -1)
+        betweens = ["%s,%s" % (names[i], names[j]) for i, j in fast_pairs]
+        world_qsr_trace = qsr_fast_path.to_world_qsr_trace(timestamps, betweens, codes, strings, self.which_qsr)
+
+        qsrs_for = [(names[i], names[j]) for i, j in pairs if not (sized[i] and sized[j])]
+        if qsrs_for:
+            request_message = QSRlib_Request_Message(which_qsr=self.which_qsr, input_data=world_trace,
+                                                     include_missing_data=True, qsrs_for=qsrs_for)
+            for t, state in self.qsrlib.request_qsrs(request_message=request_message).qsrs.trace.items():
+                for qsr in state.qsrs.values():
+                    world_qsr_trace.add_qsr(qsr, t)
+        return world_qsr_trace
+
     def save(self, filename):
         print("Saving...")
         foo = {"description": self.description, "which_qsr": self.which_qsr, "world_qsr_traces": self.world_qsr_traces}
@@ -9,6 +9,11 @@ See https://msdn.microsoft.com/en-us/library/jj131429.aspx
 
 from __future__ import print_function
 import sys
+import json
+import hashlib
+import warnings
+import bisect
+import collections
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -20,7 +25,7 @@ def median_filter(data, n=1):
     if len(data) < 2*n+1:
         return None
 
-    ret = data[0:n]
+    ret = list(data[0:n])
     for i in range(n, len(data)):
         window = data[i-n: i+n]
         window_x = [p[0] for p in window]
@@ -75,6 +80,422 @@ def lost_threshold_filter(data, thres):
     # print(dists_inc)
     return ret
 
+
+### Array versions of the filters above
+# They work on tracks of shape (T, J, 2), i.e. T frames of J joints, or on batches of episodes of shape (E, T, J, 2).
+# Episodes of different lengths are stacked with `stack_tracks`, which pads them with nans and returns their lengths.
+def tracks_dict_to_array(tracks, joints):
+    """
+    :param tracks: dict of joint -> list of (x, y) as returned by CAD120_Data_Reader.world_skeleton_trace_to_dict
+    :param joints: the joints to take, in the order of the J axis
+    :return: (T, J, 2) array
+    """
+    return np.array([tracks[j] for j in joints], dtype=float).transpose((1, 0, 2))
+
+
+def array_to_tracks_dict(array, joints):
+    """
+    :param array: (T, J, 2) array
+    :param joints: the joints of the J axis
+    :return: dict of joint -> list of (x, y)
+    """
+    return {j: [tuple(p) for p in array[:, i].tolist()] for i, j in enumerate(joints)}
+
+
+def stack_tracks(tracks):
+    """
+    :param tracks: list of (T_i, J, 2) arrays
+    :return: (E, max(T_i), J, 2) array padded with nans at the end, and the array of the lengths T_i
+    """
+    lengths = np.array([len(t) for t in tracks], dtype=int)
+    batch = np.empty((len(tracks), lengths.max()) + np.shape(tracks[0])[1:])
+    batch.fill(np.nan)
+    for i, t in enumerate(tracks):
+        batch[i, :lengths[i]] = t
+    return batch, lengths
+
+
+def _as_batch(tracks, lengths):
+    # copy into a float (E, T, J, 2) array, which is a view of the returned array of the same shape as tracks
+    data = np.array(tracks, dtype=float)
+    batch = data.reshape((-1,) + data.shape[-3:])
+    return data, batch, _lengths(batch, lengths)
+
+
+def _lengths(batch, lengths):
+    if lengths is None:
+        lengths = np.empty(batch.shape[0], dtype=int)
+        lengths.fill(batch.shape[1])
+    return np.asarray(lengths, dtype=int).reshape(-1)
+
+
+def _sliding_windows(batch, w):
+    # (E, T, J, 2) -> (E, T-w+1, J, 2, w) view of the windows along the time axis
+    sE, sT, sJ, sC = batch.strides
+    E, T, J, C = batch.shape
+    return np.lib.stride_tricks.as_strided(batch, shape=(E, T-w+1, J, C, w), strides=(sE, sT, sJ, sC, sT))
+
+
+def _median_filter_inplace(batch, n, lengths):
+    # batch can be any (E, T, J, 2) view, e.g. a slice of joints of a bigger buffer
+    E, T = batch.shape[:2]
+    if T <= n:
+        return
+    valid = ((np.arange(n, T)[None, :] < lengths[:, None]) & (lengths[:, None] >= 2*n+1))[:, :, None, None]
+    meds = []
+    if T >= 2*n:
+        # full windows [i-n, i+n) for i in [n, T-n]
+        windows = _sliding_windows(batch, 2*n)
+        with warnings.catch_warnings():
+            # windows running into the nan padding of shorter episodes, they are recomputed below
+            warnings.simplefilter("ignore", RuntimeWarning)
+            med = np.median(windows, axis=-1)
+        redo = np.isnan(med) & valid[:, :med.shape[1]]
+        if redo.any():
+            med[redo] = np.nanmedian(windows[redo], axis=-1)
+        meds.append(med)
+    # windows shrinking at the end of the longest episodes
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for i in range(max(n, T-n+1), T):
+            meds.append(np.nanmedian(batch[:, i-n:T], axis=1)[:, None])
+    med = np.concatenate(meds, axis=1)
+    batch[:, n:] = np.where(valid, np.trunc(med), batch[:, n:])
+
+
+def _threshold_filter_inplace(batch, thres, keep_previous):
+    # the nan padding past the lengths takes care of itself, as the filters are causal
+    thres = np.asarray(thres, dtype=float)
+    prev = batch[:, 0]
+    for t in range(1, batch.shape[1]):
+        cur = batch[:, t]
+        d = np.sqrt((prev[..., 0]-cur[..., 0])**2 + (prev[..., 1]-cur[..., 1])**2)
+        with np.errstate(invalid="ignore"):
+            # nan padding never satisfies the threshold, so it is left as is
+            keep = keep_previous(d, thres)
+        cur[keep] = prev[keep]
+        prev = cur
+
+
+def median_filter_array(tracks, n=1, lengths=None):
+    """
+    Same as median_filter, i.e. the first n frames are kept and frame i becomes the median of the frames [i-n, i+n)
+    truncated to an int, with the window shrinking at the end of the track. Uses sliding window views over all the
+    episodes and joints at once.
+
+    :param tracks: (T, J, 2) track or (E, T, J, 2) batch
+    :param n: half window
+    :param lengths: optional lengths of the episodes in the batch, see stack_tracks
+    :return: filtered copy of tracks; None for a single track shorter than 2*n+1, while such episodes of a batch are
+    returned unfiltered
+    """
+    data, batch, lengths = _as_batch(tracks, lengths)
+    if data.ndim == 3 and batch.shape[1] < 2*n+1:
+        return None
+    _median_filter_inplace(batch, n, lengths)
+    return data
+
+
+def jitter_threshold_filter_array(tracks, thres, lengths=None):
+    """
+    Same as jitter_threshold_filter, run as one time loop over all the episodes and joints.
+
+    :param tracks: (T, J, 2) track or (E, T, J, 2) batch
+    :param thres: scalar, or array broadcastable to (J,) for a track or (E, J) for a batch
+    :param lengths: optional lengths of the episodes in the batch, see stack_tracks
+    :return: filtered copy of tracks; None for a single track shorter than 2
+    """
+    data, batch, lengths = _as_batch(tracks, lengths)
+    if data.ndim == 3 and batch.shape[1] < 2:
+        return None
+    _threshold_filter_inplace(batch, thres, np.less)
+    return data
+
+
+def lost_threshold_filter_array(tracks, thres, lengths=None):
+    """
+    Same as lost_threshold_filter, run as one time loop over all the episodes and joints.
+
+    :param tracks: (T, J, 2) track or (E, T, J, 2) batch
+    :param thres: scalar, or array broadcastable to (J,) for a track or (E, J) for a batch
+    :param lengths: optional lengths of the episodes in the batch, see stack_tracks
+    :return: filtered copy of tracks; None for a single track shorter than 2
+    """
+    data, batch, lengths = _as_batch(tracks, lengths)
+    if data.ndim == 3 and batch.shape[1] < 2:
+        return None
+    _threshold_filter_inplace(batch, thres, np.greater)
+    return data
+
+
+class Tracks_Filters_Pipeline(object):
+    """
+    Declarative filtering of skeleton tracks: a list of chains, each one being a list of stages applied in order to
+    its own joints, e.g.
+
+        {"name": "hands_and_head",
+         "chains": [{"joints": ["H"], "stages": [["median", {"n": 3}], ["lost", {"thres": 15}]]},
+                    {"joints": ["RH", "LH"], "stages": [["jitter", {"thres": [3, 4]}], ["median", {"n": 2}]]}]}
+
+    A threshold is either a scalar, one value per joint of the chain, or one list of per joint values per episode of
+    the batch it is run on (e.g. thresholds chosen per episode by CAD120_Tracks_Filters.auto_thresholds). Every joint
+    belongs to at most one chain. The spec is plain json, so it can be saved, named and cached by its key.
+    """
+    stages_available = ("median", "jitter", "lost")
+
+    def __init__(self, chains, name=""):
+        self.name = name
+        self.chains = []
+        self.joints = []
+        for chain in chains:
+            joints = list(chain["joints"])
+            stages = [[str(stage), dict(params)] for stage, params in chain["stages"]]
+            for j in joints:
+                if j in self.joints:
+                    raise ValueError("joint '%s' is in more than one chain" % j)
+            for stage, params in stages:
+                if stage not in self.stages_available:
+                    raise ValueError("unknown stage '%s', must be one of %s" % (stage, self.stages_available))
+            self.joints += joints
+            self.chains.append({"joints": joints, "stages": stages})
+        self.joints = tuple(self.joints)
+
+    def to_dict(self):
+        return {"name": self.name, "chains": self.chains}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(chains=d["chains"], name=d.get("name", ""))
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, s):
+        return cls.from_dict(json.loads(s))
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, sort_keys=True, indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def key(self):
+        """
+        :return: hash of the chains (the name is left out), same chains give the same key
+        """
+        return hashlib.md5(json.dumps(self.chains, sort_keys=True)).hexdigest()
+
+    def run(self, batch, lengths=None, episodes=None):
+        """
+        Runs all the stages in place on a single buffer; each chain works on a view of its joints.
+
+        :param batch: (E, T, J, 2) float array, with the J axis ordered as self.joints
+        :param lengths: optional lengths of the episodes in the batch, see stack_tracks
+        :param episodes: slice of the episodes of per episode thresholds the batch holds, if only part of them
+        :return: batch
+        """
+        lengths = _lengths(batch, lengths)
+
+        def thresholds(params):
+            thres = np.asarray(params["thres"], dtype=float)
+            if thres.ndim == 2 and episodes is not None:
+                thres = thres[episodes]
+            return thres
+
+        start = 0
+        for chain in self.chains:
+            stop = start + len(chain["joints"])
+            view = batch[:, :, start:stop]
+            for stage, params in chain["stages"]:
+                if stage == "median":
+                    _median_filter_inplace(view, params.get("n", 1), lengths)
+                elif stage == "jitter":
+                    _threshold_filter_inplace(view, thresholds(params), np.less)
+                elif stage == "lost":
+                    _threshold_filter_inplace(view, thresholds(params), np.greater)
+            start = stop
+        return batch
+
+
+### Causal filters for streams of points
+# Every filter has update(point) returning the filtered point, in constant time per frame regardless of the history.
+class Running_Median_Filter(object):
+    """
+    Median of the last n points, per coordinate, over a sorted window.
+    """
+    def __init__(self, n=3, integer=True):
+        """
+        :param n: window length
+        :param integer: truncate the medians to ints like median_filter does
+        """
+        self.n = n
+        self.integer = integer
+        self.reset()
+
+    def reset(self):
+        self.window = collections.deque()
+        self.sorted_window = ([], [])
+
+    def update(self, point):
+        if len(self.window) == self.n:
+            old = self.window.popleft()
+            for c in (0, 1):
+                del self.sorted_window[c][bisect.bisect_left(self.sorted_window[c], old[c])]
+        self.window.append(point)
+        ret = []
+        for c in (0, 1):
+            bisect.insort(self.sorted_window[c], point[c])
+            k = len(self.window) // 2
+            if len(self.window) % 2 == 0:
+                ret.append((self.sorted_window[c][k-1] + self.sorted_window[c][k]) / 2.)
+            else:
+                ret.append(self.sorted_window[c][k])
+        return (int(ret[0]), int(ret[1])) if self.integer else tuple(ret)
+
+
+class Jitter_Threshold_Filter(object):
+    """
+    Causal jitter_threshold_filter: keeps the previous output while the new point is closer than thres.
+    """
+    def __init__(self, thres):
+        self.thres = thres
+        self.reset()
+
+    def reset(self):
+        self.previous = None
+
+    def update(self, point):
+        if self.previous is None or euclidean(self.previous, point) >= self.thres:
+            self.previous = point
+        return self.previous
+
+
+class Lost_Threshold_Filter(object):
+    """
+    Causal lost_threshold_filter: keeps the previous output while the new point is further than thres.
+    """
+    def __init__(self, thres):
+        self.thres = thres
+        self.reset()
+
+    def reset(self):
+        self.previous = None
+
+    def update(self, point):
+        if self.previous is None or euclidean(self.previous, point) <= self.thres:
+            self.previous = point
+        return self.previous
+
+
+class Double_Exponential_Filter(object):
+    """
+    Holt double exponential smoothing filter with jitter radius and maximum deviation clamping, as in the Kinect
+    skeletal joint smoothing white paper (https://msdn.microsoft.com/en-us/library/jj131429.aspx). The defaults are
+    for pixel tracks.
+    """
+    def __init__(self, smoothing=0.5, correction=0.5, prediction=0.5, jitter_radius=3., max_deviation_radius=4.):
+        self.smoothing = smoothing
+        self.correction = correction
+        self.prediction = prediction
+        self.jitter_radius = jitter_radius
+        self.max_deviation_radius = max_deviation_radius
+        self.reset()
+
+    def reset(self):
+        self.raw = None
+        self.filtered = None
+        self.trend = None
+        self.frame_count = 0
+
+    def update(self, point):
+        raw = np.array(point[:2], dtype=float)
+        if self.frame_count == 0:
+            filtered = raw
+            trend = np.zeros(2)
+        elif self.frame_count == 1:
+            filtered = (raw + self.raw) * 0.5
+            trend = (filtered - self.filtered) * self.correction + self.trend * (1. - self.correction)
+        else:
+            # jitter filter
+            length = np.sqrt(np.sum((raw - self.filtered)**2))
+            if length <= self.jitter_radius:
+                filtered = raw * (length / self.jitter_radius) + self.filtered * (1. - length / self.jitter_radius)
+            else:
+                filtered = raw
+            # double exponential smoothing
+            filtered = filtered * (1. - self.smoothing) + (self.filtered + self.trend) * self.smoothing
+            trend = (filtered - self.filtered) * self.correction + self.trend * (1. - self.correction)
+
+        # predict into the future to reduce latency, but do not stray too far from the raw point
+        predicted = filtered + trend * self.prediction
+        length = np.sqrt(np.sum((predicted - raw)**2))
+        if length > self.max_deviation_radius:
+            predicted = predicted * (self.max_deviation_radius / length) + raw * (1. - self.max_deviation_radius / length)
+
+        self.raw = raw
+        self.filtered = filtered
+        self.trend = trend
+        self.frame_count += 1
+        return tuple(predicted)
+
+
+class Streaming_Tracks_Filters(object):
+    """
+    Chains of causal filters per joint for live skeleton feeds, e.g. from a streaming reader call update_frame with
+    the joints of every new frame.
+    """
+    def __init__(self, chains):
+        """
+        :param chains: dict of joint -> list of filter objects with an update(point) method, applied in order
+        """
+        self.chains = chains
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """
+        Causal counterpart of a Tracks_Filters_Pipeline: a median of half window n becomes a running median of the
+        last 2*n points.
+        """
+        chains = {}
+        for chain in pipeline.chains:
+            for i, j in enumerate(chain["joints"]):
+                chains[j] = []
+                for stage, params in chain["stages"]:
+                    if stage == "median":
+                        chains[j].append(Running_Median_Filter(2 * params.get("n", 1)))
+                    else:
+                        thres = params["thres"]
+                        if np.ndim(thres) == 2:
+                            raise ValueError("per episode thresholds can not be streamed")
+                        thres = thres[i] if isinstance(thres, (list, tuple)) else thres
+                        if stage == "jitter":
+                            chains[j].append(Jitter_Threshold_Filter(thres))
+                        elif stage == "lost":
+                            chains[j].append(Lost_Threshold_Filter(thres))
+        return cls(chains)
+
+    def update(self, joint, point):
+        for f in self.chains[joint]:
+            point = f.update(point)
+        return point
+
+    def update_frame(self, frame):
+        """
+        :param frame: dict of joint -> (x, y); joints without a chain are passed through
+        :return: dict of joint -> filtered (x, y)
+        """
+        return {j: self.update(j, p) if j in self.chains else p for j, p in frame.items()}
+
+    def reset(self):
+        for chain in self.chains.values():
+            for f in chain:
+                f.reset()
+
+
 if __name__ == '__main__':
     data = [(259, 322), (259, 322), (260, 321), (259, 321), (260, 321), (260, 322), (260, 321), (259, 321), (260, 321), (259, 320), (258, 320), (257, 319), (256, 320), (255, 319), (255, 319), (255, 319), (256, 319), (256, 318), (257, 319), (257, 318), (257, 318), (257, 319), (259, 318), (261, 317), (263, 315), (265, 315), (267, 315), (269, 315), (271, 313), (274, 312), (277, 312), (280, 312), (282, 313), (289, 311), (293, 302), (296, 294), (298, 289), (300, 287), (301, 287), (303, 286), (306, 285), (309, 285), (313, 283), (315, 282), (320, 280), (323, 277), (327, 276), (330, 276), (334, 276), (339, 276), (345, 277), (350, 275), (356, 275), (363, 277), (370, 280), (376, 280), (383, 281), (390, 284), (397, 287), (402, 289), (408, 292), (412, 295), (416, 299), (418, 302), (420, 305), (420, 306), (421, 308), (423, 311), (424, 314), (425, 317), (426, 318), (427, 319), (427, 320), (428, 321), (428, 322), (428, 322), (429, 322), (429, 322), (429, 322), (429, 323), (429, 323), (428, 324), (428, 324), (428, 324), (428, 325), (428, 325), (428, 324), (429, 324), (428, 325), (428, 325), (426, 325), (426, 326), (425, 325), (425, 326), (424, 326), (425, 326), (425, 326), (425, 325), (425, 324), (425, 324), (424, 324), (416, 326), (411, 324), (410, 322), (412, 320), (411, 319), (410, 318), (409, 317), (408, 316), (408, 314), (408, 312), (409, 310), (410, 307), (410, 304), (411, 301), (411, 298), (411, 295), (411, 293), (412, 289), (412, 287), (413, 283), (413, 280), (412, 275), (413, 271), (413, 267), (413, 262), (413, 258), (417, 248), (416, 233), (417, 227), (414, 219), (415, 215), (409, 206), (411, 205), (396, 192), (404, 194), (394, 178), (394, 170), (398, 175), (418, 173), (426, 175), (423, 174), (419, 174), (415, 174), (413, 175), (411, 175), (408, 175), (406, 175), (402, 174), (398, 173), (396, 172), (393, 170), (390, 169), (386, 168), (384, 138), (386, 121), (387, 106), (388, 100), (388, 93), (385, 90), (385, 89), (383, 84), (382, 82), (381, 78), (379, 73), (377, 70), (372, 66), (368, 63), (364, 61), (361, 56), (354, 52), (349, 48), (344, 44), (341, 40), (338, 36), (339, 26), (340, 20), (328, 24), (322, 27), (308, 36), (340, 83), (354, 128), (356, 168), (351, 200), (342, 226), (332, 246), (322, 262), (314, 274), (305, 283), (298, 290), (291, 295), (284, 300), (278, 304), (273, 306), (268, 309), (264, 311), (260, 312), (257, 313), (254, 313), (251, 314), (250, 315), (248, 316), (247, 315), (245, 315), (243, 315), (243, 313), (243, 313), (242, 314), (242, 312), (241, 311), (240, 311), (240, 310), (240, 310), (240, 310), (240, 310), (239, 309), (239, 310), (239, 310), (239, 311), (239, 311), (239, 311), (239, 312), (239, 311), (239, 311), (239, 310), (240, 311), (240, 311), (240, 310), (240, 311), (240, 311), (241, 312), (241, 311), (240, 310), (240, 309), (240, 310), (240, 310), (240, 310), (241, 310), (242, 311), (242, 310), (243, 311), (243, 311), (243, 310), (243, 309), (243, 308), (243, 308), (243, 309), (243, 309), (244, 309), (244, 309), (244, 309), (244, 309), (243, 311), (243, 311), (243, 310), (243, 309), (244, 310), (244, 309), (245, 310), (245, 310), (245, 309), (245, 309), (245, 310), (245, 311), (244, 313), (244, 312), (244, 312), (243, 312), (242, 311), (241, 310), (240, 309), (239, 309), (238, 309), (238, 308), (237, 308), (236, 309), (235, 309), (234, 309), (233, 308), (232, 309), (232, 307), (231, 308), (230, 307), (228, 306), (228, 305), (227, 305), (227, 304), (228, 303), (228, 303), (229, 301), (230, 302), (231, 304), (233, 306), (234, 307), (235, 308), (319, 263), (353, 197), (364, 149), (362, 115), (356, 95), (350, 85), (331, 67), (331, 73), (331, 81), (331, 88), (332, 94), (332, 102), (332, 111), (332, 119), (332, 125), (332, 132), (332, 141), (331, 146), (331, 153), (332, 160), (331, 167), (331, 173), (331, 180), (331, 184), (333, 191), (335, 197), (337, 203), (338, 208), (339, 213), (340, 217), (343, 221), (345, 225), (345, 228), (347, 233), (350, 237), (352, 240), (353, 244), (355, 249), (357, 253), (359, 258), (359, 263), (360, 265), (359, 269), (358, 271), (355, 274), (354, 275), (351, 278), (351, 285), (349, 286), (349, 295), (346, 295), (343, 293), (346, 306), (346, 314), (349, 321), (349, 324), (350, 325), (351, 326), (352, 326), (348, 315), (344, 319), (340, 321), (337, 323), (334, 324), (331, 326), (329, 327), (328, 330)]
     print(data)
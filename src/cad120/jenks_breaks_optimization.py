@@ -9,7 +9,10 @@ import matplotlib.pyplot as plt
 # code from http://danieljlewis.org/files/2010/06/Jenks.pdf
 # described at http://danieljlewis.org/2010/06/07/jenks-natural-breaks-algorithm-in-python/
 
-def getJenksBreaks( dataList, numClass ):
+def getJenksBreaksLoops( dataList, numClass ):
+  """
+  The original pure python implementation, kept as a reference for getJenksBreaks. Sorts dataList in place.
+  """
   dataList.sort()
   mat1 = []
   for i in range(0,len(dataList)+1):
@@ -63,38 +66,170 @@ def getJenksBreaks( dataList, numClass ):
   return kclass
 
 
+def _jenks_tables(values, numClass, counts=None):
+    """
+    The dynamic programming tables of getJenksBreaksLoops (mat1: start index of the last class, mat2: sum of squared
+    deviations), as int/float arrays. Row l is computed at once for all the start indexes and classes; the sums
+    of values and squares are accumulated with cumsum over the reversed prefix, i.e. in the same order as the loops,
+    so that the tables and hence the breaks are identical.
+
+    The leading axes of values are a batch of independent data sets: row l only depends on the l first values, so data
+    sets of different lengths can be padded at the end (with zero counts) and their tables read up to their length.
+
+    :param values: sorted float array, or (..., n) array of sorted rows
+    :param numClass: number of classes
+    :param counts: optional weight of every value, e.g. the number of times it is repeated, same shape as values
+    :return: mat1, mat2, of shape (..., n+1, numClass+1)
+    """
+    n = values.shape[-1]
+    batch = values.shape[:-1]
+    if counts is not None:
+        counts = np.asarray(counts, dtype=float)
+        weighted = values * counts
+        weighted2 = weighted * values
+    mat1 = np.zeros(batch + (n+1, numClass+1), dtype=int)
+    mat2 = np.zeros(batch + (n+1, numClass+1))
+    mat1[..., 1, 1:] = 1
+    mat2[..., 2:, 1:] = np.inf
+    for l in range(2, n+1):
+        if counts is None:
+            seg = values[..., l-1::-1]
+            s1 = np.cumsum(seg, axis=-1)
+            s2 = np.cumsum(seg * seg, axis=-1)
+            v = s2 - (s1 * s1) / np.arange(1, l+1)
+        else:
+            s1 = np.cumsum(weighted[..., l-1::-1], axis=-1)
+            s2 = np.cumsum(weighted2[..., l-1::-1], axis=-1)
+            # the padding of shorter data sets divides by zero, in rows past their length
+            with np.errstate(invalid="ignore", divide="ignore"):
+                v = s2 - (s1 * s1) / np.cumsum(counts[..., l-1::-1], axis=-1)
+        if numClass >= 2:
+            # candidates for the last class starting at i3 = 2..l, for j = 2..numClass classes; the loops keep the
+            # last candidate with the minimum, i.e. the smallest i3, which is the first one argmin finds
+            cand = v[..., l-2::-1, None] + mat2[..., 1:l, 1:numClass]
+            mat1[..., l, 2:] = np.argmin(cand, axis=-2) + 2
+            mat2[..., l, 2:] = np.min(cand, axis=-2)
+        mat1[..., l, 1] = 1
+        mat2[..., l, 1] = v[..., -1]
+    return mat1, mat2
+
+
+def _jenks_backtrack(values, mat1, numClass):
+    k = len(values)
+    kclass = [0] * (numClass+1)
+    kclass[numClass] = float(values[-1])
+    countNum = numClass
+    while countNum >= 2:
+        id = int(mat1[k][countNum] - 2)
+        kclass[countNum - 1] = float(values[id])
+        k = int(mat1[k][countNum] - 1)
+        countNum -= 1
+    return kclass
+
+
+def getJenksBreaks(dataList, numClass):
+    """
+    Jenks natural breaks, same breaks as getJenksBreaksLoops but with numpy and without sorting dataList in place.
+
+    :param dataList: list or array of values
+    :param numClass: number of classes
+    :return: list of numClass+1 values, the first being 0 and the rest the upper bound of each class
+    """
+    values = np.sort(np.asarray(dataList, dtype=float))
+    mat1, _ = _jenks_tables(values, numClass)
+    return _jenks_backtrack(values, mat1, numClass)
+
+
+def unique_counts(data):
+    """
+    :return: sorted unique values of data and the number of times each one appears
+    """
+    values = np.sort(np.asarray(data, dtype=float))
+    starts = np.concatenate(([True], values[1:] != values[:-1]))
+    idx = np.flatnonzero(starts)
+    return values[idx], np.diff(np.concatenate((idx, [len(values)])))
+
+
+def histogram_counts(data, bins):
+    """
+    Approximation of data by at most `bins` quantile bins, i.e. bins holding about the same number of sorted values.
+
+    :return: mean of every bin, number of values in every bin, largest value of every bin
+    """
+    values = np.sort(np.asarray(data, dtype=float))
+    bounds = np.unique(np.linspace(0, len(values), min(bins, len(values)) + 1).astype(int))
+    counts = np.diff(bounds)
+    csum = np.concatenate(([0.], np.cumsum(values)))
+    means = (csum[bounds[1:]] - csum[bounds[:-1]]) / counts
+    return means, counts, values[bounds[1:] - 1]
+
+
+def getJenksBreaksWeighted(values, counts, numClass, labels=None):
+    """
+    Jenks natural breaks of sorted unique values, each one repeated counts times. A class never splits the copies of a
+    value, so the DP runs over the unique values only and reaches the same optimum as getJenksBreaks of the repeated
+    values (as long as numClass does not exceed the number of unique values). The sums are accumulated in another
+    order though, so classifications of (nearly) equal variance may be chosen differently and the breaks differ.
+
+    :param values: sorted unique values
+    :param counts: number of times each value is repeated
+    :param numClass: number of classes
+    :param labels: optional value to report for every entry of values in the breaks, e.g. the largest value of a bin
+    :return: list of numClass+1 values, the first being 0 and the rest the upper bound of each class
+    """
+    values = np.asarray(values, dtype=float)
+    mat1, _ = _jenks_tables(values, numClass, counts)
+    return _jenks_backtrack(values if labels is None else np.asarray(labels, dtype=float), mat1, numClass)
+
+
+def jenks_breaks(data, numClass, method="unique", bins=1024):
+    """
+    :param data: list or array of values
+    :param numClass: number of classes
+    :param method: "exact" for getJenksBreaks over all the values, "unique" for the same optimum over the unique values
+    and their counts (ties may resolve to other breaks, see getJenksBreaksWeighted), "histogram" for an approximation
+    over quantile bins when there are more than `bins` unique values
+    :param bins: number of bins of the "histogram" method
+    :return: list of numClass+1 values, the first being 0 and the rest the upper bound of each class
+    """
+    if method == "exact":
+        return getJenksBreaks(data, numClass)
+    values, counts = unique_counts(data)
+    if method == "histogram" and len(values) > bins:
+        means, counts, maxs = histogram_counts(data, bins)
+        return getJenksBreaksWeighted(means, counts, numClass, labels=maxs)
+    if numClass > len(values):
+        return getJenksBreaks(data, numClass)
+    return getJenksBreaksWeighted(values, counts, numClass)
+
+
+def benchmark_jenks_breaks(data, numClass=5, number=3):
+    """
+    Times getJenksBreaks against getJenksBreaksLoops and checks that they give the same breaks.
+    """
+    loops = timeit.timeit(lambda: getJenksBreaksLoops(list(data), numClass), number=number) / number
+    vectorized = timeit.timeit(lambda: getJenksBreaks(data, numClass), number=number) / number
+    same = getJenksBreaksLoops(list(data), numClass) == getJenksBreaks(data, numClass)
+    print "n=%d, classes=%d: loops %.4f secs, numpy %.4f secs (x%.1f), same breaks: %s" % \
+        (len(data), numClass, loops, vectorized, loops / vectorized, same)
+    return loops, vectorized, same
+
+
 def getGVF( dataList, numClass ):
   """
   The Goodness of Variance Fit (GVF) is found by taking the
   difference between the squared deviations
   from the array mean (SDAM) and the squared deviations from the
   class means (SDCM), and dividing by the SDAM
+
+  A class spans the sorted data from after the first occurrence of its lower break (from the start if the break is 0)
+  to the first occurrence of its upper break, computed from prefix sums. dataList is not sorted in place.
   """
-  breaks = getJenksBreaks(dataList, numClass)
-  dataList.sort()
-  listMean = sum(dataList)/len(dataList)
-  print listMean
-  SDAM = 0.0
-  for i in range(0,len(dataList)):
-    sqDev = (dataList[i] - listMean)**2
-    SDAM += sqDev
-  SDCM = 0.0
-  for i in range(0,numClass):
-    if breaks[i] == 0:
-      classStart = 0
-    else:
-      classStart = dataList.index(breaks[i])
-      classStart += 1
-    classEnd = dataList.index(breaks[i+1])
-    classList = dataList[classStart:classEnd+1]
-    classMean = sum(classList)/len(classList)
-    print classMean
-    preSDCM = 0.0
-    for j in range(0,len(classList)):
-      sqDev2 = (classList[j] - classMean)**2
-      preSDCM += sqDev2
-    SDCM += preSDCM
-  return (SDAM - SDCM)/SDAM
+  breaks = np.asarray(getJenksBreaks(dataList, numClass), dtype=float)
+  values, csum, csum2, sdam = _gvf_prefix_sums(dataList)
+  starts = np.where(breaks[:-1] == 0, 0, np.searchsorted(values, breaks[:-1], side="left") + 1)
+  ends = np.searchsorted(values, breaks[1:], side="left") + 1
+  return (sdam - _sdcm(starts, ends, csum, csum2)) / sdam
 
 
 # written by Drew
@@ -106,47 +241,172 @@ def classify(value, breaks):
   return len(breaks) - 1
 
 
+def classify_values(values, breaks):
+    """
+    Vectorized classify: the class of each value against sorted breaks, in one call.
+
+    :param values: scalar, list or array of values of any shape
+    :param breaks: sorted breaks, as returned by getJenksBreaks
+    :return: int array of the shape of values with classes in 1..len(breaks)-1
+    """
+    breaks = np.asarray(breaks, dtype=float)
+    classes = np.searchsorted(breaks[1:], values, side="right") + 1
+    return np.minimum(classes, len(breaks) - 1)
+
+
+def gvf_from_breaks(data, breaks):
+    """
+    Goodness of variance fit of data classified with classify_values against breaks, from prefix sums over the sorted
+    data, so O(n log n) for the sort and O(k log n) per set of breaks.
+
+    :param data: list or array of values
+    :param breaks: sorted breaks, as returned by getJenksBreaks
+    :return: GVF
+    """
+    values, csum, csum2, sdam = _gvf_prefix_sums(data)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _gvf_sorted(values, breaks, csum, csum2, sdam)
+
+
 def goodness_of_variance_fit(array, classes):
     # get the break points
     classes = getJenksBreaks(array, classes)
+    gvf = gvf_from_breaks(array, classes)
+    return gvf, classes
 
-    # do the actual classification
-    classified = np.array([classify(i, classes) for i in array])
 
-    # max value of zones
-    maxz = max(classified)
+def _gvf_prefix_sums(data):
+    """
+    Sorted values, prefix sums of the mean centred sorted values and of their squares, and the sum of squared
+    deviations from the mean (SDAM).
+    """
+    values = np.sort(np.asarray(data, dtype=float).ravel())
+    centred = values - values.mean()
+    csum = np.concatenate(([0.], np.cumsum(centred)))
+    csum2 = np.concatenate(([0.], np.cumsum(centred**2)))
+    return values, csum, csum2, csum2[-1]
 
-    # nested list of zone indices
-    zone_indices = [[idx for idx, val in enumerate(classified) if zone + 1 == val] for zone in range(maxz)]
 
-    # sum of squared deviations from array mean
-    sdam = np.sum((array - array.mean()) ** 2)
+def _sdcm(starts, ends, csum, csum2):
+    """
+    Sum of squared deviations from the class means of classes spanning [starts, ends) of the sorted values.
+    """
+    w = ends - starts
+    nonempty = w > 0
+    s1 = (csum[ends] - csum[starts])[nonempty]
+    s2 = (csum2[ends] - csum2[starts])[nonempty]
+    return np.sum(s2 - s1**2 / w[nonempty])
 
-    # sorted polygon stats
-    array_sort = [np.array([array[index] for index in zone]) for zone in zone_indices]
 
-    # sum of squared deviations of class means
-    sdcm = sum([np.sum((classified - classified.mean()) ** 2) for classified in array_sort])
+def _gvf_sorted(values, breaks, csum, csum2, sdam):
+    """
+    GVF of breaks with the classes of classify (a class holds the values from its lower break, inclusive, up to its
+    upper break, exclusive, except for the last class), from prefix sums of the sorted, mean centred values.
+    """
+    bounds = np.concatenate(([0], np.searchsorted(values, breaks[1:-1], side="left"), [len(values)]))
+    bounds = np.maximum.accumulate(bounds)
+    return (sdam - _sdcm(bounds[:-1], bounds[1:], csum, csum2)) / sdam
 
-    # goodness of variance fit
-    gvf = (sdam - sdcm) / sdam
 
-    return gvf, classes
+def jenks_break_optimization(data, gvf_thres=0.6, gvf=0.0, nclasses=1, kmax=10, unique=False, bins=None):
+    """
+    Finds the smallest number of classes, from nclasses on, whose Jenks breaks have a goodness of variance fit of at
+    least gvf_thres. The DP tables are computed once for up to kmax classes, as they hold the optimal breaks of every
+    smaller number of classes too, and the GVF of every number of classes is read from them. kmax is doubled if
+    the threshold is not met, up to one class per value.
+
+    :param data: list or array of values
+    :param gvf_thres: GVF threshold
+    :param gvf: unused, kept for backwards compatibility
+    :param nclasses: smallest number of classes to try
+    :param kmax: number of classes of the first DP tables
+    :param unique: run the DP over the unique values and their counts, see getJenksBreaksWeighted. Much faster on
+    data with many repeated values, but never tries more classes than unique values
+    :param bins: if given, approximate the data by that many quantile bins when it has more unique values than that
+    :return: number of classes, its GVF, its breaks and the GVF curve as a dict of number of classes -> GVF
+    """
+    values, csum, csum2, sdam = _gvf_prefix_sums(data)
+
+    labels = None
+    dp_values, counts = values, None
+    if unique or bins is not None:
+        dp_values, counts = unique_counts(values)
+        if bins is not None and len(dp_values) > bins:
+            dp_values, counts, labels = histogram_counts(values, bins)
+        elif nclasses > len(dp_values) or not unique:
+            dp_values, counts = values, None
+    n = len(dp_values)
+
+    gvfs = {}
+    kmax = max(min(kmax, n), nclasses)
+    k = nclasses
+    while True:
+        mat1, _ = _jenks_tables(dp_values, kmax, counts)
+        for k in range(k, kmax+1):
+            breaks = _jenks_backtrack(dp_values if labels is None else labels, mat1, k)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                gvfs[k] = _gvf_sorted(values, breaks, csum, csum2, sdam)
+            if not gvfs[k] < gvf_thres:
+                return k, gvfs[k], breaks, gvfs
+        if kmax >= n:
+            return k, gvfs[k], breaks, gvfs
+        k, kmax = kmax + 1, min(2 * kmax, n)
+
+
+def jenks_break_optimization_batch(datasets, gvf_thres=0.6, nclasses=1, kmax=10):
+    """
+    jenks_break_optimization(data, gvf_thres, nclasses=nclasses, kmax=kmax, unique=True) of many data sets, with the
+    DP tables of all of them computed in one pass over their unique values padded to the same length, instead of a
+    pass per data set. The few data sets whose threshold is not met within kmax classes go on on their own.
+
+    :param datasets: list of lists or arrays of values
+    :return: list of the results of jenks_break_optimization, None for an empty data set
+    """
+    results = [None] * len(datasets)
+    batch = []
+    for i, data in enumerate(datasets):
+        data = np.asarray(data, dtype=float).ravel()
+        if len(data) == 0:
+            continue
+        prefix_sums = _gvf_prefix_sums(data)
+        dp_values, counts = unique_counts(prefix_sums[0])
+        if nclasses > len(dp_values):
+            results[i] = jenks_break_optimization(data, gvf_thres, nclasses=nclasses, kmax=kmax, unique=True)
+        else:
+            batch.append((i, data, prefix_sums, dp_values, counts))
+    if not batch:
+        return results
+
+    n = max(len(dp_values) for _, _, _, dp_values, _ in batch)
+    padded_values = np.zeros((len(batch), n))
+    padded_counts = np.zeros((len(batch), n))
+    for b, (_, _, _, dp_values, counts) in enumerate(batch):
+        padded_values[b, :len(dp_values)] = dp_values
+        padded_values[b, len(dp_values):] = dp_values[-1]
+        padded_counts[b, :len(dp_values)] = counts
+    mat1, _ = _jenks_tables(padded_values, max(min(kmax, n), nclasses), padded_counts)
 
+    for b, (i, data, (values, csum, csum2, sdam), dp_values, counts) in enumerate(batch):
+        # the columns up to kmax of the batch tables are the tables of the data set alone
+        kmax_i = max(min(kmax, len(dp_values)), nclasses)
+        gvfs = {}
+        for k in range(nclasses, kmax_i+1):
+            breaks = _jenks_backtrack(dp_values, mat1[b], k)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                gvfs[k] = _gvf_sorted(values, breaks, csum, csum2, sdam)
+            if not gvfs[k] < gvf_thres:
+                break
+        if gvfs[k] < gvf_thres and kmax_i < len(dp_values):
+            results[i] = jenks_break_optimization(data, gvf_thres, nclasses=nclasses, kmax=kmax, unique=True)
+        else:
+            results[i] = k, gvfs[k], breaks, gvfs
+    return results
 
-def jenks_break_optimization(data, gvf_thres=0.6, gvf=0.0, nclasses=1):
-    if not isinstance(data, np.ndarray):
-        data = np.array(data)
-    while gvf < gvf_thres and nclasses <= len(data):
-        # print "computing gvf classes"
-        gvf, classes = goodness_of_variance_fit(data, nclasses)
-        # print nclasses, gvf, classes
-        nclasses += 1
-    return nclasses, gvf, classes
 
 if __name__ == '__main__':
     data = [81.394102980498531, 60.745370193949761, 48.703182647543684, 46.518813398452032, 43.289721643826724, 41.048751503547585, 36.0, 29.614185789921695, 28.635642126552707, 27.0, 24.698178070456937, 24.0, 20.591260281974002, 17.029386365926403, 16.643316977093239, 16.15549442140351, 16.0, 15.132745950421556, 13.45362404707371, 13.152946437965905, 12.0, 12.0, 11.313708498984761, 10.04987562112089, 10.0, 10.0, 9.4339811320566032, 9.2195444572928871, 9.2195444572928871, 9.2195444572928871, 9.0553851381374173, 9.0, 8.6023252670426267, 8.6023252670426267, 8.5440037453175304, 8.0622577482985491, 8.0, 8.0, 8.0, 7.810249675906654, 7.6157731058639087, 7.6157731058639087, 7.6157731058639087, 7.2801098892805181, 7.2801098892805181, 7.2801098892805181, 7.2801098892805181, 7.2111025509279782, 7.0710678118654755, 7.0710678118654755, 7.0710678118654755, 7.0710678118654755, 7.0710678118654755, 7.0710678118654755, 7.0, 7.0, 7.0, 7.0, 7.0, 7.0, 7.0, 6.7082039324993694, 6.7082039324993694, 6.7082039324993694, 6.4031242374328485, 6.4031242374328485, 6.324555320336759, 6.324555320336759, 6.324555320336759, 6.0827625302982193, 6.0827625302982193, 6.0827625302982193, 6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 5.8309518948453007, 5.8309518948453007, 5.6568542494923806, 5.6568542494923806, 5.6568542494923806, 5.6568542494923806, 5.3851648071345037, 5.3851648071345037, 5.3851648071345037, 5.3851648071345037, 5.3851648071345037, 5.0990195135927845, 5.0990195135927845, 5.0990195135927845, 5.0990195135927845, 5.0990195135927845, 5.0990195135927845, 5.0990195135927845, 5.0990195135927845, 5.0990195135927845, 5.0, 5.0, 5.0, 5.0, 5.0, 5.0, 5.0, 5.0, 5.0, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.4721359549995796, 4.2426406871192848, 4.2426406871192848, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.1231056256176606, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0, 3.6055512754639891, 3.6055512754639891, 3.6055512754639891, 3.6055512754639891, 3.6055512754639891, 3.6055512754639891, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.1622776601683795, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 2.8284271247461903, 2.8284271247461903, 2.8284271247461903, 2.8284271247461903, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.2360679774997898, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.4142135623730951, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
     print jenks_break_optimization(data)
+    benchmark_jenks_breaks(data, 5)
 
     # jenks = getJenksBreaks(data, 1)
     # print jenks
@@ -9,63 +9,251 @@ import matplotlib.pyplot as plt
 import cPickle as pickle
 import timeit
 import time
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
 
 from cad120_data_reader import CAD120_Data_Reader
 from cad120_opencv_video_viewer.cad120_opencv_video_viewer import CAD120_OpenCV_Video_Viewer
 import filters
+import jenks_breaks_optimization as jenks
+
+# state of a worker process of CAD120_Tracks_Filters.filter_skeleton_parallel
+_filter_worker = {}
+
+
+def _init_filter_worker(shared, shape, lengths, pipeline):
+    _filter_worker["batch"] = np.frombuffer(shared, dtype=float).reshape(shape)
+    _filter_worker["lengths"] = lengths
+    _filter_worker["pipeline"] = filters.Tracks_Filters_Pipeline.from_dict(pipeline)
+
+
+def _filter_episodes(task):
+    batch, lengths, pipeline = _filter_worker["batch"], _filter_worker["lengths"], _filter_worker["pipeline"]
+    timings = []
+    for i in range(*task):
+        start = timeit.default_timer()
+        pipeline.run(batch[i:i+1, :lengths[i]], lengths[i:i+1], episodes=slice(i, i+1))
+        timings.append((i, timeit.default_timer() - start))
+    return timings
+
 
 class CAD120_Tracks_Filters(object):
     def __init__(self, reader):
         self.reader = reader
+        # unfiltered skeleton tracks of all episodes, extracted once on first use
+        self.ids = None
+        self.joints = None
+        self.tracks = None
+        self.lengths = None
+        # filtered batches by pipeline key
+        self.filtered = {}
+        # automatic (jitter, lost) thresholds by (episode, joint, gvf_thres)
+        self.thresholds = {}
+
+
+    def extract_skeleton_tracks(self):
+        start = timeit.default_timer()
+        self.ids = sorted(self.reader.world_traces.keys())
+        self.joints = tuple(self.reader.skeleton_pass_filter)
+        self.reader.make_skeleton_columns()
+        self.tracks, self.lengths = filters.stack_tracks([self.reader.skeleton_tracks_to_array(id, self.joints)
+                                                          for id in self.ids])
+        stop = timeit.default_timer()
+        print("Skeleton tracks extracted in: %.2f secs" % (stop - start))
 
 
     def filter_skeleton(self, skeleton=("H", "RH", "LH"), jitter=False, lost=False):
         if jitter is None and lost is None:
             return
-        start = timeit.default_timer()
-        all_episodes_skeleton_tracks = self.reader.world_skeleton_traces_to_dict()
-        # print(all_episodes_tracks["Subject1_arranging_objects_0510175411"].keys())
         print("Filtering skeleton tracks (jitter:%s, lost:%s)" % (jitter, lost))
-        for id, tracks in all_episodes_skeleton_tracks.items():
-            if lost:
-                for j in skeleton:
-                    tracks[j] = filters.median_filter(tracks[j], 3)
-                    tracks[j] = filters.lost_threshold_filter(tracks[j], 15)
-            if jitter:
-                for j in skeleton:
-                    # print(j, tracks[j])
-                    tracks[j] = filters.jitter_threshold_filter(tracks[j], 3)
-                    tracks[j] = filters.median_filter(tracks[j], 2)
-                    # print(j, tracks[j])
-                    # print()
-
-
-
-
-            self.change_reader(id, tracks)
-            # foo = []
-            # obj = "RH"
-            # world_trace = self.reader.world_traces[id]
-            # sorted_timestamps = world_trace.get_sorted_timestamps()
-            # for t in sorted_timestamps:
-            #     world_state = world_trace.trace[t]
-            #     foo.append((world_state.objects[obj].x, world_state.objects[obj].y))
-            # print(foo)
+        stages = []
+        if lost:
+            stages += [["median", {"n": 3}], ["lost", {"thres": 15}]]
+        if jitter:
+            stages += [["jitter", {"thres": 3}], ["median", {"n": 2}]]
+        pipeline = filters.Tracks_Filters_Pipeline(chains=[{"joints": skeleton, "stages": stages}],
+                                                   name="jitter:%s,lost:%s" % (jitter, lost))
+        self.filter_skeleton_pipeline(pipeline)
+
+
+    def step_distances(self, joints):
+        """
+        Frame to frame distances of the joints of all episodes, in one go.
+
+        :param joints: joints to compute the distances of
+        :return: (E, T-1, J) float array, nan past the length of each episode
+        """
+        if self.tracks is None:
+            self.extract_skeleton_tracks()
+        tracks = self.tracks[:, :, [self.joints.index(j) for j in joints]]
+        return np.sqrt(np.sum(np.diff(tracks, axis=1)**2, axis=-1))
+
+
+    def auto_thresholds(self, joints, gvf_thres=0.8, jitter=3., lost=15., cache=True):
+        """
+        Per episode and joint jitter and lost thresholds from the natural breaks of the frame to frame distances. The
+        smallest number of classes reaching gvf_thres is found with jenks_break_optimization; the upper break of the
+        smallest class becomes the jitter threshold (two classes or more) and the lower break of the largest class the
+        lost threshold (three classes or more), as long as the jitter one stays below the lost one.
+        The Jenks DP runs over the unique distances, which are few as the joints are in pixels, for all the episodes
+        and joints in one batch (see jenks_break_optimization_batch).
+
+        :param joints: joints to compute the thresholds of
+        :param gvf_thres: GVF threshold of jenks_break_optimization
+        :param jitter: jitter threshold of the tracks with too few classes
+        :param lost: lost threshold of the tracks with too few classes
+        :param cache: reuse the thresholds computed before for an episode and joint
+        :return: jitter and lost thresholds, each a (E, J) float array
+        """
+        start = timeit.default_timer()
+        dists = self.step_distances(joints)
+        keys, datasets = [], []
+        for e, (id, length) in enumerate(zip(self.ids, self.lengths)):
+            for j, joint in enumerate(joints):
+                key = (id, joint, gvf_thres)
+                if not cache or key not in self.thresholds:
+                    keys.append(key)
+                    datasets.append(dists[e, :length-1, j])
+        for key, result in zip(keys, jenks.jenks_break_optimization_batch(datasets, gvf_thres)):
+            thres = [None, None]
+            if result is not None:
+                k, _, breaks, _ = result
+                if k >= 2:
+                    thres[0] = breaks[1]
+                if k >= 3:
+                    thres[1] = breaks[-2]
+            self.thresholds[key] = tuple(thres)
+
+        jitters = np.full(dists.shape[::2], jitter)
+        losts = np.full(dists.shape[::2], lost)
+        for e, id in enumerate(self.ids):
+            for j, joint in enumerate(joints):
+                thres = self.thresholds[(id, joint, gvf_thres)]
+                if thres[0] is not None:
+                    jitters[e, j] = thres[0]
+                if thres[1] is not None:
+                    losts[e, j] = thres[1]
+        # two classes may well split the steps from the jumps rather than the jitter from the steps
+        jitters = np.where(jitters < losts, jitters, np.minimum(jitter, losts))
+        stop = timeit.default_timer()
+        print("Automatic thresholds computed in: %.2f secs" % (stop - start))
+        return jitters, losts
+
+
+    def filter_skeleton_auto(self, skeleton=("H", "RH", "LH"), jitter=False, lost=False, gvf_thres=0.8, parallel=False):
+        """
+        Same as filter_skeleton, with the jitter and lost thresholds of every episode and joint chosen by
+        auto_thresholds instead of the fixed 3 and 15.
+
+        :param parallel: filter with filter_skeleton_parallel
+        """
+        if not jitter and not lost:
+            return
+        print("Filtering skeleton tracks with automatic thresholds (jitter:%s, lost:%s)" % (jitter, lost))
+        skeleton = list(skeleton)
+        jitters, losts = self.auto_thresholds(skeleton, gvf_thres)
+        stages = []
+        if lost:
+            stages += [["median", {"n": 3}], ["lost", {"thres": losts.tolist()}]]
+        if jitter:
+            stages += [["jitter", {"thres": jitters.tolist()}], ["median", {"n": 2}]]
+        pipeline = filters.Tracks_Filters_Pipeline(chains=[{"joints": skeleton, "stages": stages}],
+                                                   name="jitter:%s,lost:%s,gvf:%s" % (jitter, lost, gvf_thres))
+        if parallel:
+            self.filter_skeleton_parallel(pipeline)
+        else:
+            self.filter_skeleton_pipeline(pipeline)
+
+
+    def filter_skeleton_pipeline(self, pipeline, cache=True, sync=True):
+        """
+        Filters the skeleton tracks of all episodes with a Tracks_Filters_Pipeline and writes them to the reader. The
+        pipeline always starts from the unfiltered tracks, so different pipelines can be run one after the other
+        without reloading the reader.
+
+        :param pipeline: Tracks_Filters_Pipeline
+        :param cache: reuse the result of a previous run of a pipeline with the same key
+        :param sync: also update the world traces of the reader, otherwise only its columnar skeleton tracks are swapped
+        and the world traces get updated on reader.sync_world_traces()
+        """
+        start = timeit.default_timer()
+        print("Filtering skeleton tracks with pipeline <%s>" % (pipeline.name or pipeline.key()))
+        if self.tracks is None:
+            self.extract_skeleton_tracks()
+        key = pipeline.key()
+        if cache and key in self.filtered:
+            batch = self.filtered[key]
+        else:
+            # a single buffer holding the joints of the pipeline that all stages work on in place
+            batch = self.tracks[:, :, [self.joints.index(j) for j in pipeline.joints]]
+            pipeline.run(batch, self.lengths)
+            if cache:
+                self.filtered[key] = batch
+
+        self.write_back(batch, pipeline.joints, sync)
         stop = timeit.default_timer()
         print("Skeleton tracks filtered in: %.2f secs" % (stop - start))
 
 
-    def change_reader(self, id, tracks):
-        world_trace = self.reader.world_traces[id]
-        sorted_timestamps = world_trace.get_sorted_timestamps()
-        for j, track in tracks.items():
-            if len(sorted_timestamps) != len(track):
-                raise ValueError(id, j, "len(sorted_timestamps, track):", len(sorted_timestamps), len(track))
+    def filter_skeleton_parallel(self, pipeline, processes=None, batch_size=1, cache=True, sync=True):
+        """
+        Same as filter_skeleton_pipeline, but the episodes are distributed in batches to worker processes. The tracks
+        live in a shared memory array which the workers filter in place, so only episode indexes are pickled.
 
-            for p, t in zip(track, sorted_timestamps):
-                world_state = world_trace.trace[t]
-                world_state.objects[j].x = p[0]
-                world_state.objects[j].y = p[1]
+        :param pipeline: Tracks_Filters_Pipeline
+        :param processes: number of worker processes, number of cpus if None
+        :param batch_size: number of episodes per task
+        :param cache: reuse the result of a previous run of a pipeline with the same key
+        :param sync: also update the world traces of the reader
+        :return: dict of episode -> filtering time in secs
+        """
+        start = timeit.default_timer()
+        print("Filtering skeleton tracks in parallel with pipeline <%s>" % (pipeline.name or pipeline.key()))
+        if self.tracks is None:
+            self.extract_skeleton_tracks()
+        key = pipeline.key()
+        timings = {}
+        if cache and key in self.filtered:
+            batch = self.filtered[key]
+        else:
+            shape = self.tracks.shape[:2] + (len(pipeline.joints),) + self.tracks.shape[3:]
+            shared = RawArray(ctypes.c_double, int(np.prod(shape)))
+            batch = np.frombuffer(shared, dtype=float).reshape(shape)
+            batch[:] = self.tracks[:, :, [self.joints.index(j) for j in pipeline.joints]]
+
+            tasks = [(i, min(i + batch_size, len(self.ids))) for i in range(0, len(self.ids), batch_size)]
+            pool = multiprocessing.Pool(processes=processes, initializer=_init_filter_worker,
+                                        initargs=(shared, shape, self.lengths, pipeline.to_dict()))
+            try:
+                for episodes_timings in pool.imap_unordered(_filter_episodes, tasks):
+                    for i, secs in episodes_timings:
+                        timings[self.ids[i]] = secs
+            finally:
+                pool.close()
+                pool.join()
+            if cache:
+                self.filtered[key] = batch
+
+        self.write_back(batch, pipeline.joints, sync)
+        stop = timeit.default_timer()
+        if timings:
+            secs = timings.values()
+            print("Per episode filtering secs: min %.4f, mean %.4f, max %.4f" % (min(secs), np.mean(secs), max(secs)))
+        print("Skeleton tracks filtered in: %.2f secs" % (stop - start))
+        return timings
+
+
+    def write_back(self, batch, joints, sync=True):
+        for id, tracks, length in zip(self.ids, batch, self.lengths):
+            self.reader.set_skeleton_tracks(id, tracks[:length], joints, sync=False)
+        if sync:
+            self.reader.sync_world_traces()
+
+
+    def change_reader(self, id, tracks):
+        joints = list(tracks.keys())
+        self.reader.set_skeleton_tracks(id, filters.tracks_dict_to_array(tracks, joints), joints, sync=True)
 
 
     # def filter_skeleton_lost_track(self, thresholds={"H": 10, "LH": 50, "RH": 50}):
@@ -108,6 +296,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--ini", help="ini file", required=True)
     parser.add_argument("-e", "--episode", help="episode")
+    parser.add_argument("-a", "--auto", help="choose the filters thresholds per episode and joint", action="store_true")
     args = parser.parse_args()
 
     inis_path = os.environ.get("INIS")
@@ -162,7 +351,10 @@ if __name__ == '__main__':
 
     # plt.scatter(*zip(*data[200:]), color="blue")
 
-    smoother.filter_skeleton(jitter=True, lost=True)
+    if args.auto:
+        smoother.filter_skeleton_auto(jitter=True, lost=True)
+    else:
+        smoother.filter_skeleton(jitter=True, lost=True)
 
     # data = reader.world_skeleton_trace_to_dict(id=args.episode)["RH"]
     # plt.scatter(*zip(*data), color="red")
@@ -7,16 +7,18 @@ __copyright__   = "Copyright 2015, University of Leeds"
 
 import os, sys
 import pickle
+import hashlib
 import numpy as np
 
 import qsrlib_io.world_trace
+import qsrlib_io.world_qsr_trace
 
 #**************************************************************#
 #     Compute Episode Representation of the Spatial Relations  #
 #**************************************************************#
 #print keeper.reader.spatial_relations['7d638405-b2f8-55ce-b593-efa8e3f2ff2e'].trace[1].qsrs['Printer (photocopier)_5,trajectory'].qsr
 
-def compute_episodes(uuid, spatial_relations):
+def compute_episodes_loops(uuid, spatial_relations):
     episodes  = {}
     obj_relation_data = {}
     #print(type(spatial_relations))
@@ -76,6 +78,201 @@ def compute_episodes(uuid, spatial_relations):
 
 
 
+def encode_relations(spatial_relations):
+    """
+    Dictionary encodes the relations of every object pair, in frame order, in a single pass: every relation is mapped
+    to an integer code by its string form.
+
+    :param spatial_relations: World_QSR_Trace, or dict of frame -> dict of object pair -> relation
+    :return: sorted frames, dict of object pair -> (frames, codes, relations) and the list of strings by code. The
+    relations are only kept for a dict (None otherwise), as the ones of a World_QSR_Trace are their strings
+    """
+    pair_data = {}
+    codes_of = {}
+    strings = []
+    if isinstance(spatial_relations, qsrlib_io.world_qsr_trace.World_QSR_Trace):
+        frames = sorted(spatial_relations.trace.keys())
+        for frame in frames:
+            for obj_pair, qsr in spatial_relations.trace[frame].qsrs.iteritems():
+                string = "%s" % qsr.qsr  #qsr needs to be a string
+                code = codes_of.get(string)
+                if code is None:
+                    code = codes_of[string] = len(strings)
+                    strings.append(string)
+                if obj_pair in pair_data:
+                    pair_data[obj_pair][0].append(frame)
+                    pair_data[obj_pair][1].append(code)
+                else:
+                    pair_data[obj_pair] = ([frame], [code], None)
+    elif type(spatial_relations) == dict:
+        frames = sorted(spatial_relations.keys())
+        for frame in frames:
+            for obj_pair, relation in spatial_relations[frame].iteritems():
+                string = "%s" % relation
+                code = codes_of.get(string)
+                if code is None:
+                    code = codes_of[string] = len(strings)
+                    strings.append(string)
+                if obj_pair in pair_data:
+                    pair_data[obj_pair][0].append(frame)
+                    pair_data[obj_pair][1].append(code)
+                    pair_data[obj_pair][2].append(relation)
+                else:
+                    pair_data[obj_pair] = ([frame], [code], [relation])
+    else:
+        raise TypeError("spatial_relations must be a World_QSR_Trace or a dict, not %s" % type(spatial_relations))
+    return frames, pair_data, strings
+
+
+def compute_episodes(uuid, spatial_relations):
+    """
+    Run length encodes the relations of every object pair into episodes: the relations are dictionary encoded to
+    integer codes (encode_relations) and the episodes of a pair start where its codes change, found with np.diff.
+    Same output as compute_episodes_loops: episode tuples (uuid, 'traj', obj id, obj type, relation, start, end), with
+    the relation of the first episode of a pair formatted as a string and the rest as given.
+
+    :param uuid: trajectory uuid
+    :param spatial_relations: World_QSR_Trace, or dict of frame -> dict of object pair -> relation
+    :return: key "<uuid>__<first frame>__<last frame>" ("None" for both if there are no frames) and dict of
+    (uuid, 'traj', obj id, obj type) -> list of episodes
+    """
+    frames, pair_data, strings = encode_relations(spatial_relations)
+    episodes = {}
+    for obj_pair, data in pair_data.items():
+        key = episodes_key(uuid, obj_pair)
+        episodes[key] = [key + episode for episode in pair_episodes(data, strings)]
+    return trajectory_key(uuid, frames), episodes
+
+
+def trajectory_key(uuid, frames):
+    if frames:
+        return '__'.join([uuid, repr(min(frames)), repr(max(frames))])
+    return '__'.join([uuid, repr(None), repr(None)])
+
+
+def episodes_key(uuid, obj_pair):
+    obj = obj_pair.replace(',trajectory', ' ')
+    return (uuid, 'traj', obj, obj.split('_')[0])
+
+
+def pair_episodes(data, strings):
+    """
+    The (relation, start, end) episodes of an object pair, see encode_relations, with the episodes starting where the
+    codes change.
+    """
+    obj_frames, codes, relations = data
+    starts = (np.flatnonzero(np.diff(codes)) + 1).tolist()
+    ends = [start - 1 for start in starts] + [len(codes) - 1]
+    if relations is None:
+        values = [strings[codes[start]] for start in [0] + starts]
+    else:
+        # the first relation always as a string
+        values = ["%s" % relations[0]] + [relations[start] for start in starts]
+    starts.insert(0, 0)
+    return [(value, obj_frames[start], obj_frames[end]) for value, start, end in zip(values, starts, ends)]
+
+
+def filter_episodes(episodes, noise_threshold, merge_first=False):
+    """
+    Generator version of filter_intervals: merges the episodes shorter than noise_threshold into the previous one as
+    they come, and drops a short first episode, or merges it into the next one if merge_first.
+
+    :param episodes: iterable of episode tuples (..., relation, start, end)
+    :return: generator of the filtered episode tuples
+    """
+    def resolve(first, second):
+        # the filtered first and second intervals
+        if first[-1] - first[-2] >= noise_threshold:
+            return [first, second]
+        if merge_first:
+            return [second[:-2] + first[-2:-1] + second[-1:]]
+        return [second]
+
+    newf = None
+    first = None
+    resolved = False
+    for f in episodes:
+        if newf is None:
+            newf = f
+        elif str(newf[-3]) == str(f[-3]) or f[-1] - f[-2] < noise_threshold:
+            # same relation, or too short a different one: merge with the previous interval
+            newf = newf[:-1] + f[-1:]
+        elif resolved:
+            yield newf
+            newf = f
+        elif first is None:
+            # whether the first interval is kept depends on it being followed by another one
+            first = newf
+            newf = f
+        else:
+            for episode in resolve(first, newf):
+                yield episode
+            resolved = True
+            newf = f
+    if newf is None:
+        return
+    if first is None or resolved:
+        yield newf
+    else:
+        for episode in resolve(first, newf):
+            yield episode
+
+
+def stream_episodes(uuid, spatial_relations, noise_threshold=3, merge_first=False):
+    """
+    compute_episodes and filter_intervals fused: the episodes of every pair are filtered as they are produced.
+
+    :return: the key of the trajectory, as of compute_episodes, and a generator of (pair key, filtered episode)
+    """
+    frames, pair_data, strings = encode_relations(spatial_relations)
+
+    def generate():
+        for obj_pair, data in pair_data.items():
+            key = episodes_key(uuid, obj_pair)
+            for episode in filter_episodes(pair_episodes(data, strings), noise_threshold, merge_first):
+                yield key, key + episode
+
+    return trajectory_key(uuid, frames), generate()
+
+
+def relations_frames(spatial_relations):
+    """
+    :return: frames of a World_QSR_Trace or dict of frame -> relations, e.g. for trajectory_key without the relations
+    """
+    if isinstance(spatial_relations, qsrlib_io.world_qsr_trace.World_QSR_Trace):
+        return spatial_relations.trace.keys()
+    return spatial_relations.keys()
+
+
+def relations_digest(spatial_relations):
+    """
+    md5 of the relations of every frame and pair, e.g. kept in the manifest of a sharded store so that
+    relations_fingerprint does not need to read the relations again.
+    """
+    md5 = hashlib.md5()
+    is_trace = isinstance(spatial_relations, qsrlib_io.world_qsr_trace.World_QSR_Trace)
+    for frame in sorted(relations_frames(spatial_relations)):
+        if is_trace:
+            relations = [(obj_pair, "%s" % qsr.qsr) for obj_pair, qsr in spatial_relations.trace[frame].qsrs.items()]
+        else:
+            relations = [(obj_pair, "%s" % relation) for obj_pair, relation in spatial_relations[frame].items()]
+        md5.update(repr((frame, sorted(relations))))
+    return md5.hexdigest()
+
+
+def relations_fingerprint(spatial_relations, *params, **kwargs):
+    """
+    md5 of the relations and of params, e.g. the episodes parameters, to tell whether the episodes computed from them
+    are still up to date.
+
+    :param digest: relations_digest of spatial_relations if known, spatial_relations is not read then
+    """
+    digest = kwargs.get("digest")
+    if digest is None:
+        digest = relations_digest(spatial_relations)
+    return hashlib.md5(repr((params, str(digest)))).hexdigest()
+
+
 def filter_intervals(intv_list_dup, noise_threshold):
     intv_list = intv_list_dup[:]
     filtered_intv_list = []
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""episodes_db.py
+
+Indexed episode store on SQLite: one row per episode, with indexes on the object type, the relation and the time, so
+queries like all the "approaching Printer" episodes read only the matching rows instead of the whole
+all_episodes pickle.
+"""
+
+from __future__ import print_function
+import sqlite3
+import itertools
+
+_columns = ("traj_key", "obj0_id", "obj0_type", "obj1_id", "obj1_type", "relation", "start", "end")
+
+
+class Episodes_DB(object):
+    def __init__(self, filename=":memory:"):
+        """
+        :param filename: SQLite database file, created if missing, or ":memory:"
+        """
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS episodes (
+                traj_key TEXT NOT NULL,
+                obj0_id TEXT NOT NULL,
+                obj0_type TEXT,
+                obj1_id TEXT NOT NULL,
+                obj1_type TEXT,
+                relation TEXT,
+                start INTEGER,
+                "end" INTEGER);
+            CREATE INDEX IF NOT EXISTS episodes_type_relation_time ON episodes (obj1_type, relation, start, "end");
+            CREATE INDEX IF NOT EXISTS episodes_relation_time ON episodes (relation, start, "end");
+            CREATE INDEX IF NOT EXISTS episodes_time ON episodes (start, "end");
+            CREATE INDEX IF NOT EXISTS episodes_traj ON episodes (traj_key);
+            CREATE INDEX IF NOT EXISTS episodes_uuid ON episodes (obj0_id);
+            CREATE INDEX IF NOT EXISTS episodes_obj ON episodes (obj1_id);
+            """)
+
+    def close(self):
+        self.connection.close()
+
+    def insert_episodes(self, episodes, chunk_size=10000):
+        """
+        Bulk insert, in one transaction.
+
+        :param episodes: iterable of (trajectory key, pair key, episode), as of Episodes.iter_episodes; the relations
+        are stored as strings
+        :param chunk_size: rows per executemany call
+        :return: number of rows inserted
+        """
+        with self.connection:
+            return self._insert(episodes, chunk_size)
+
+    def insert_all_episodes(self, all_episodes, replace=True):
+        """
+        Bulk insert, in one transaction with the deletion of the replaced rows, so a failed insert leaves the old rows.
+
+        :param all_episodes: dict of trajectory key -> dict of pair key -> list of episodes, as Episodes.all_episodes
+        :param replace: delete the rows of the trajectories first, so they can be inserted again after an update
+        :return: number of rows inserted
+        """
+        with self.connection:
+            if replace:
+                self._delete(all_episodes.keys())
+            return self._insert((key, obj_key, episode)
+                                for key, fepi in all_episodes.items()
+                                for obj_key, episodes in fepi.items()
+                                for episode in episodes)
+
+    def delete_trajectories(self, keys):
+        with self.connection:
+            self._delete(keys)
+
+    # the statements without a transaction of their own, so several can share one
+    def _insert(self, episodes, chunk_size=10000):
+        rows = ((key,) + tuple(episode[:4]) + ("%s" % episode[4],) + tuple(episode[5:7])
+                for key, _, episode in episodes)
+        count = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            self.connection.executemany("INSERT INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", chunk)
+            count += len(chunk)
+        return count
+
+    def _delete(self, keys):
+        self.connection.executemany("DELETE FROM episodes WHERE traj_key = ?", ((key,) for key in keys))
+
+    def _where(self, uuid=None, obj_id=None, obj_type=None, relation=None, start=None, end=None, traj_key=None):
+        conditions, params = [], []
+        for column, value in (("obj0_id", uuid), ("obj1_id", obj_id), ("obj1_type", obj_type),
+                              ("relation", relation), ("traj_key", traj_key)):
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                conditions.append("%s IN (%s)" % (column, ", ".join("?" * len(value))))
+                params += value
+            else:
+                conditions.append("%s = ?" % column)
+                params.append(value)
+        # episodes overlapping [start, end]
+        if end is not None:
+            conditions.append("start <= ?")
+            params.append(end)
+        if start is not None:
+            conditions.append('"end" >= ?')
+            params.append(start)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def query(self, uuid=None, obj_id=None, obj_type=None, relation=None, start=None, end=None, traj_key=None,
+              limit=None, order=False):
+        """
+        Episodes matching all the given conditions, read lazily. Every condition but start and end can also be a list
+        of accepted values. The episodes come in the order of the index SQLite picks, unless order is True, in which
+        case all the matching rows are sorted before the first one is returned.
+
+        :param uuid: trajectory uuid
+        :param obj_id: object id, as in the episodes (e.g. "Printer (photocopier)_5 ")
+        :param obj_type: object type, e.g. "Printer (photocopier)"
+        :param relation: relation string
+        :param start: episodes ending at or after start
+        :param end: episodes starting at or before end
+        :param traj_key: trajectory key, as of all_episodes
+        :param limit: maximum number of episodes
+        :param order: sort the episodes by trajectory key, object and start
+        :return: generator of (trajectory key, episode) with the episodes as tuples
+        (uuid, 'traj', obj id, obj type, relation, start, end)
+        """
+        where, params = self._where(uuid, obj_id, obj_type, relation, start, end, traj_key)
+        sql = "SELECT %s FROM episodes%s" % (", ".join('"%s"' % c for c in _columns), where)
+        if order:
+            sql += " ORDER BY traj_key, obj1_id, start"
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+        for row in self.connection.execute(sql, params):
+            yield row[0], tuple(row[1:])
+
+    def count(self, uuid=None, obj_id=None, obj_type=None, relation=None, start=None, end=None, traj_key=None):
+        where, params = self._where(uuid, obj_id, obj_type, relation, start, end, traj_key)
+        return self.connection.execute("SELECT COUNT(*) FROM episodes" + where, params).fetchone()[0]
+
+    def relations_count(self, obj_type=None):
+        """
+        :return: dict of relation -> number of episodes, of an object type if given
+        """
+        where, params = self._where(obj_type=obj_type)
+        return dict(self.connection.execute("SELECT relation, COUNT(*) FROM episodes%s GROUP BY relation" % where,
+                                            params))
+
+    def all_episodes(self, **conditions):
+        """
+        The matching episodes as a dict of trajectory key -> dict of pair key -> list of episodes, as
+        Episodes.all_episodes; the relations are strings and the episodes of a pair sorted by start.
+        """
+        all_episodes = {}
+        for key, episode in self.query(order=True, **conditions):
+            all_episodes.setdefault(key, {}).setdefault(episode[:4], []).append(episode)
+        return all_episodes
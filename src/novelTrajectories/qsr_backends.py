@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+"""qsr_backends.py
+
+Backends that Trajectory_Data_Reader requests its QSRs from: QSRlib in the same process, a QSRlib ROS service
+through a single, reused client, or a service through a pool of clients making requests concurrently. All take batches
+of worlds, which are merged into one namespaced world and sent as a single request, and the resulting World_QSR_Trace
+is split back per world.
+"""
+
+from __future__ import print_function
+import copy
+import itertools
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from qsrlib.qsrlib import QSRlib, QSRlib_Request_Message
+from qsrlib_io.world_trace import World_Trace
+from qsrlib_io.world_qsr_trace import World_QSR_Trace, World_QSR_State
+try:
+    from qsrlib_ros.qsrlib_ros_client import QSRlib_ROS_Client
+except ImportError:
+    QSRlib_ROS_Client = None
+
+
+def default_qsrs_for(world):
+    """
+    The object pairs QSRlib computes relations for when qsrs_for is not given: every combination of the sorted object
+    names of the world.
+    """
+    names = set()
+    for state in world.trace.values():
+        names.update(state.objects.keys())
+    return list(itertools.combinations(sorted(names), 2))
+
+
+def merge_worlds(worlds, qsrs_for=None):
+    """
+    Merges worlds into a single World_Trace, with the objects of the i-th world renamed to "<i>:<name>". An
+    Object_State shared by many frames of a world stays shared in the merged world.
+
+    :param worlds: list of World_Trace objects
+    :param qsrs_for: optional list with the object pairs of every world, default_qsrs_for of the world if None
+    :return: the merged World_Trace, the namespaced object pairs and a dict of namespaced "o1,o2" -> (i, "o1,o2")
+    """
+    merged = World_Trace()
+    pairs = []
+    betweens = {}
+    for i, world in enumerate(worlds):
+        renamed = {}
+        for t, state in world.trace.items():
+            for name, object_state in state.objects.items():
+                if id(object_state) not in renamed:
+                    renamed[id(object_state)] = copy.copy(object_state)
+                    renamed[id(object_state)].name = "%d:%s" % (i, name)
+                merged.add_object_state_to_trace(renamed[id(object_state)], t)
+        world_qsrs_for = qsrs_for[i] if qsrs_for is not None and qsrs_for[i] is not None else default_qsrs_for(world)
+        for o1, o2 in world_qsrs_for:
+            pair = ("%d:%s" % (i, o1), "%d:%s" % (i, o2))
+            pairs.append(pair)
+            betweens["%s,%s" % pair] = (i, "%s,%s" % (o1, o2))
+    return merged, pairs, betweens
+
+
+def split_world_qsr_trace(world_qsr_trace, worlds, betweens, include_missing_data=True):
+    """
+    Splits the World_QSR_Trace of merged worlds back into one World_QSR_Trace per world, see merge_worlds.
+    """
+    traces = [World_QSR_Trace(qsr_type=world_qsr_trace.qsr_type) for _ in worlds]
+    for t, state in world_qsr_trace.trace.items():
+        for between, qsr in state.qsrs.items():
+            i, between = betweens[between]
+            qsr = copy.copy(qsr)
+            qsr.between = between
+            traces[i].add_qsr(qsr, t)
+    if include_missing_data:
+        for world, trace in zip(worlds, traces):
+            for t in world.trace:
+                if t not in trace.trace:
+                    trace.trace[t] = World_QSR_State(timestamp=t)
+    return traces
+
+
+class QSRlib_Backend(object):
+    """
+    Base of the backends: subclasses implement request_qsrs for one request message.
+    """
+    # number of requests the backend works on at the same time
+    concurrency = 1
+
+    def request_qsrs(self, request_message):
+        """
+        :param request_message: QSRlib_Request_Message
+        :return: World_QSR_Trace
+        """
+        raise NotImplementedError("%s must implement request_qsrs" % self.__class__.__name__)
+
+    def request_world_qsrs(self, which_qsr, world, qsrs_for=None, include_missing_data=True):
+        return self.request_qsrs(self.make_request_message(which_qsr, world, qsrs_for, include_missing_data))
+
+    def make_request_message(self, which_qsr, world, qsrs_for=None, include_missing_data=True):
+        kwargs = {"qsrs_for": qsrs_for} if qsrs_for is not None else {}
+        return QSRlib_Request_Message(which_qsr=which_qsr, input_data=world,
+                                      include_missing_data=include_missing_data, **kwargs)
+
+    def batch_requests(self, which_qsr, worlds, qsrs_for=None, batch_size=100, include_missing_data=True):
+        """
+        The requests of request_qsrs_batch, made lazily.
+
+        :return: generator of (request message, worlds of the request, betweens), the request message being None if
+        there is nothing to request and betweens None if the request is for a single world, see merge_worlds
+        """
+        if batch_size <= 1:
+            for i, world in enumerate(worlds):
+                yield (self.make_request_message(which_qsr, world, qsrs_for[i] if qsrs_for else None,
+                                                 include_missing_data), [world], None)
+            return
+        for start in range(0, len(worlds), batch_size):
+            batch = worlds[start:start+batch_size]
+            batch_qsrs_for = qsrs_for[start:start+batch_size] if qsrs_for else None
+            merged, pairs, betweens = merge_worlds(batch, batch_qsrs_for)
+            # an empty qsrs_for would mean all the pairs to QSRlib
+            request_message = self.make_request_message(which_qsr, merged, pairs, include_missing_data) if pairs \
+                else None
+            yield request_message, batch, betweens
+
+    def split_response(self, which_qsr, world_qsr_trace, worlds, betweens, include_missing_data=True):
+        """
+        :return: list with the World_QSR_Trace of every world of a request of batch_requests
+        """
+        if betweens is None:
+            return [world_qsr_trace]
+        if world_qsr_trace is None:
+            world_qsr_trace = World_QSR_Trace(qsr_type=which_qsr)
+        return split_world_qsr_trace(world_qsr_trace, worlds, betweens, include_missing_data)
+
+    def request_qsrs_batch(self, which_qsr, worlds, qsrs_for=None, batch_size=100, include_missing_data=True):
+        """
+        QSRs of many worlds, batch_size worlds per request.
+
+        :param which_qsr: QSR to compute
+        :param worlds: list of World_Trace objects
+        :param qsrs_for: optional list with the object pairs of every world, default_qsrs_for of the world if None
+        :param batch_size: worlds per request, one request per world if 1 or less
+        :param include_missing_data: passed on to QSRlib
+        :return: list with the World_QSR_Trace of every world
+        """
+        traces = []
+        for request_message, batch, betweens in self.batch_requests(which_qsr, worlds, qsrs_for, batch_size,
+                                                                    include_missing_data):
+            world_qsr_trace = self.request_qsrs(request_message) if request_message is not None else None
+            traces += self.split_response(which_qsr, world_qsr_trace, batch, betweens, include_missing_data)
+        return traces
+
+
+class QSRlib_Local_Backend(QSRlib_Backend):
+    """
+    QSRlib in the same process, no ROS needed.
+    """
+    def __init__(self, qsrlib=None):
+        self.qsrlib = qsrlib if qsrlib is not None else QSRlib()
+
+    def request_qsrs(self, request_message):
+        return self.qsrlib.request_qsrs(request_message=request_message).qsrs
+
+
+class QSRlib_ROS_Backend(QSRlib_Backend):
+    """
+    A QSRlib ROS service, through a client created once and reused for every request.
+    """
+    def __init__(self, client=None):
+        if client is None:
+            if QSRlib_ROS_Client is None:
+                raise ImportError("qsrlib_ros is needed for the ROS backend")
+            client = QSRlib_ROS_Client()
+        self.client = client
+
+    def request_qsrs(self, request_message):
+        req = self.client.make_ros_request_message(request_message)
+        res = self.client.request_qsrs(req)
+        return pickle.loads(res.data).qsrs
+
+
+class QSRlib_Concurrent_Backend(QSRlib_Backend):
+    """
+    Requests made concurrently by a pool of worker threads, each one with its own persistent client. The requests are
+    made lazily and queued to the workers through a bounded queue, so no more than queue_size of them wait in memory.
+    Failed requests are retried, and the responses are assembled in the order of the requests.
+    """
+    def __init__(self, client_factory=None, workers=4, queue_size=None, retries=2, retry_delay=0.5):
+        """
+        :param client_factory: callable returning a new client with the interface of QSRlib_ROS_Client,
+        QSRlib_ROS_Client if None
+        :param workers: number of worker threads and clients
+        :param queue_size: maximum number of requests waiting for a worker, twice the workers if None
+        :param retries: times a failed request is retried before giving up
+        :param retry_delay: secs to wait before retrying, doubled on every retry
+        """
+        if client_factory is None:
+            if QSRlib_ROS_Client is None:
+                raise ImportError("qsrlib_ros is needed for the ROS clients, or pass a client_factory")
+            client_factory = QSRlib_ROS_Client
+        self.client_factory = client_factory
+        self.concurrency = workers
+        self.queue_size = queue_size if queue_size is not None else 2 * workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.clients = queue.Queue()
+        for _ in range(workers):
+            self.clients.put(client_factory())
+
+    def request_with_client(self, client, request_message):
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                req = client.make_ros_request_message(request_message)
+                res = client.request_qsrs(req)
+                return pickle.loads(res.data).qsrs
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def request_qsrs(self, request_message):
+        client = self.clients.get()
+        try:
+            return self.request_with_client(client, request_message)
+        finally:
+            self.clients.put(client)
+
+    def request_qsrs_batch(self, which_qsr, worlds, qsrs_for=None, batch_size=100, include_missing_data=True):
+        tasks = queue.Queue(maxsize=self.queue_size)
+        responses = {}
+        errors = []
+
+        def work():
+            client = self.clients.get()
+            try:
+                while True:
+                    task = tasks.get()
+                    if task is None:
+                        return
+                    n, request_message = task
+                    try:
+                        if not errors:
+                            responses[n] = self.request_with_client(client, request_message)
+                    except Exception as e:
+                        errors.append(e)
+            finally:
+                self.clients.put(client)
+
+        threads = [threading.Thread(target=work) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        requests = []
+        try:
+            for n, (request_message, batch, betweens) in enumerate(self.batch_requests(
+                    which_qsr, worlds, qsrs_for, batch_size, include_missing_data)):
+                requests.append((batch, betweens))
+                if errors:
+                    break
+                if request_message is None:
+                    responses[n] = None
+                else:
+                    # blocks while the queue is full
+                    tasks.put((n, request_message))
+        finally:
+            for _ in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+        traces = []
+        for n, (batch, betweens) in enumerate(requests):
+            traces += self.split_response(which_qsr, responses[n], batch, betweens, include_missing_data)
+        return traces
+
+
+class QSRlib_Local_Service(object):
+    """
+    Stand-in for the QSRlib ROS service: QSRlib in this process answering pickled requests, with an optional latency
+    to mimic the network round trip. Lets the concurrent backend be tested and benchmarked without ROS, through
+    QSRlib_Local_Service_Client.
+    """
+    def __init__(self, qsrlib=None, latency=0.0):
+        self.qsrlib = qsrlib if qsrlib is not None else QSRlib()
+        self.latency = latency
+        # QSRlib is not meant to be used by many threads at once
+        self.lock = threading.Lock()
+
+    def handle(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        request_message = pickle.loads(data)
+        with self.lock:
+            response_message = self.qsrlib.request_qsrs(request_message=request_message)
+        return pickle.dumps(response_message, pickle.HIGHEST_PROTOCOL)
+
+    def make_client(self):
+        return QSRlib_Local_Service_Client(self)
+
+
+class _Local_Service_Message(object):
+    def __init__(self, data):
+        self.data = data
+
+
+class QSRlib_Local_Service_Client(object):
+    """
+    Client of a QSRlib_Local_Service with the interface of QSRlib_ROS_Client.
+    """
+    def __init__(self, service):
+        self.service = service
+
+    def make_ros_request_message(self, request_message):
+        return _Local_Service_Message(pickle.dumps(request_message, pickle.HIGHEST_PROTOCOL))
+
+    def request_qsrs(self, req):
+        return _Local_Service_Message(self.service.handle(req.data))
+
+
+def make_local_service_backend(workers=4, latency=0.0):
+    """
+    A QSRlib_Concurrent_Backend whose clients talk to a QSRlib_Local_Service.
+    """
+    service = QSRlib_Local_Service(latency=latency)
+    return QSRlib_Concurrent_Backend(client_factory=service.make_client, workers=workers)
+
+
+def benchmark_backends(which_qsr, worlds, backends, batch_size=100):
+    """
+    Times request_qsrs_batch of every backend on the same worlds.
+
+    :param backends: dict of name -> QSRlib_Backend
+    :return: dict of name -> secs
+    """
+    timings = {}
+    for name, backend in sorted(backends.items()):
+        start = time.time()
+        backend.request_qsrs_batch(which_qsr, worlds, batch_size=batch_size)
+        timings[name] = time.time() - start
+        print("%s: %d worlds in %.2f secs" % (name, len(worlds), timings[name]))
+    return timings
+
+
+backends = {"local": QSRlib_Local_Backend,
+            "ros": QSRlib_ROS_Backend,
+            "ros_concurrent": QSRlib_Concurrent_Backend,
+            "local_service": make_local_service_backend}
+
+
+def make_backend(backend="local"):
+    """
+    :param backend: "local", "ros", "ros_concurrent", "local_service" or a QSRlib_Backend object, which is returned
+    as is
+    :return: QSRlib_Backend
+    """
+    if isinstance(backend, QSRlib_Backend):
+        return backend
+    try:
+        return backends[backend]()
+    except KeyError:
+        raise ValueError("unknown backend '%s', must be one of %s" % (backend, sorted(backends.keys())))
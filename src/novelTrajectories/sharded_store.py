@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""sharded_store.py
+
+Sharded, append only persistence of big dicts, e.g. the QSR traces of Trajectory_QSR_Keeper or the episodes of
+Episodes. The values are pickled one after the other into shard files, grouped by key prefix or by a label such as
+the date, and a json manifest keeps the shard and offset of every key, so a value is read on its own when accessed.
+Appending writes new shards only; a key appended again points to its newest value.
+"""
+
+from __future__ import print_function
+import os
+import re
+import json
+import collections
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class Sharded_Store(object):
+    manifest_name = "manifest.json"
+
+    def __init__(self, path, prefix_length=2):
+        """
+        :param path: directory of the store, created if missing
+        :param prefix_length: length of the key prefix the shards are grouped by, when appending without a label
+        """
+        self.path = path
+        self.prefix_length = prefix_length
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        manifest = os.path.join(path, self.manifest_name)
+        if os.path.isfile(manifest):
+            with open(manifest, "r") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"meta": {}, "shards": [], "index": {}}
+
+    @property
+    def meta(self):
+        """
+        json serialisable metadata of the store, e.g. the QSR parameters, saved with the manifest
+        """
+        return self.manifest["meta"]
+
+    def keys(self):
+        return self.manifest["index"].keys()
+
+    def __contains__(self, key):
+        return key in self.manifest["index"]
+
+    def __len__(self):
+        return len(self.manifest["index"])
+
+    def append(self, items, label=None):
+        """
+        Writes the items to new shards and updates the manifest.
+
+        :param items: iterable of (key, value), the keys being strings
+        :param label: name of a single shard for all the items (e.g. a date), otherwise they are grouped in shards by
+        the prefix of their keys
+        :return: number of items written
+        """
+        shards = {}
+        count = 0
+        try:
+            for key, value in items:
+                group = label if label is not None else key[:self.prefix_length]
+                if group not in shards:
+                    name = "%s.%04d.p" % (re.sub(r"[^\w\-]", "_", str(group)), len(self.manifest["shards"]))
+                    self.manifest["shards"].append(name)
+                    shards[group] = (name, open(os.path.join(self.path, name), "wb"))
+                name, f = shards[group]
+                self.manifest["index"][key] = (name, f.tell())
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+                count += 1
+        finally:
+            for name, f in shards.values():
+                f.close()
+        self.save_manifest()
+        return count
+
+    def save_manifest(self):
+        # written aside and renamed, so a crash never leaves a half written manifest
+        manifest = os.path.join(self.path, self.manifest_name)
+        with open(manifest + ".tmp", "w") as f:
+            json.dump(self.manifest, f)
+        os.rename(manifest + ".tmp", manifest)
+
+    def load(self, key):
+        name, offset = self.manifest["index"][key]
+        with open(os.path.join(self.path, name), "rb") as f:
+            f.seek(offset)
+            return pickle.load(f)
+
+
+class Lazy_Sharded_Dict(collections.MutableMapping):
+    """
+    Dict view of a Sharded_Store: a value is read from its shard when first accessed, and set values are kept in
+    memory until flush appends them to the store. As the store is append only, only the values set since the last
+    flush can be deleted; deleting a key of the store raises a TypeError.
+    """
+    def __init__(self, store, cache=True):
+        """
+        :param store: Sharded_Store
+        :param cache: keep the values read, otherwise they are read again on every access
+        """
+        self.store = store
+        self.cache = cache
+        self.loaded = {}
+        self.updated = {}
+
+    def __getitem__(self, key):
+        if key in self.updated:
+            return self.updated[key]
+        if key in self.loaded:
+            return self.loaded[key]
+        if key not in self.store:
+            raise KeyError(key)
+        value = self.store.load(key)
+        if self.cache:
+            self.loaded[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.updated[key] = value
+        self.loaded.pop(key, None)
+
+    def __delitem__(self, key):
+        if key in self.store:
+            raise TypeError("cannot delete '%s', the sharded store is append only" % key)
+        del self.updated[key]
+
+    def __contains__(self, key):
+        return key in self.updated or key in self.store
+
+    def __iter__(self):
+        for key in self.store.keys():
+            if key not in self.updated:
+                yield key
+        for key in self.updated:
+            yield key
+
+    def __len__(self):
+        return len(self.store) + sum(1 for key in self.updated if key not in self.store)
+
+    def flush(self, label=None):
+        """
+        Appends the values set since the last flush to the store.
+
+        :return: number of values appended
+        """
+        count = self.store.append(self.updated.items(), label)
+        if self.cache:
+            self.loaded.update(self.updated)
+        self.updated = {}
+        return count
+
+
+def save_sharded(data, path, label=None, meta=None, prefix_length=2):
+    """
+    Appends a dict to the store at path; only the values set since loading are appended for a Lazy_Sharded_Dict of
+    the same store.
+
+    :param data: dict or Lazy_Sharded_Dict
+    :param meta: metadata to update the store's with
+    :return: the Sharded_Store
+    """
+    if isinstance(data, Lazy_Sharded_Dict) and os.path.abspath(data.store.path) == os.path.abspath(path):
+        store = data.store
+        if meta:
+            store.meta.update(meta)
+        if data.flush(label) == 0:
+            store.save_manifest()
+        return store
+    store = Sharded_Store(path, prefix_length)
+    if meta:
+        store.meta.update(meta)
+    store.append(data.items(), label)
+    return store
+
+
+def load_sharded(path, cache=True):
+    """
+    :return: Lazy_Sharded_Dict of the store at path
+    """
+    if not os.path.isfile(os.path.join(path, Sharded_Store.manifest_name)):
+        raise IOError("no sharded store at %s" % path)
+    return Lazy_Sharded_Dict(Sharded_Store(path), cache)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""spatial_index.py
+
+Spatial index over the (static) object positions, to select the objects near a trajectory before computing QSRs.
+Uses a scipy KD-tree if scipy is installed, otherwise a uniform grid in numpy.
+"""
+
+from __future__ import print_function
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class Objects_Spatial_Index(object):
+    def __init__(self, objects, cell_size=1.0, use_kdtree=True):
+        """
+        :param objects: dict of object name -> (x, y) or (x, y, z); only x and y are indexed
+        :param cell_size: cell size of the grid, best set to the query radius; 1 if not positive, e.g. a radius of 0
+        :param use_kdtree: use a scipy KD-tree when scipy is available
+        """
+        self.names = sorted(objects.keys())
+        self.points = np.array([objects[name][:2] for name in self.names], dtype=float).reshape(-1, 2)
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        self.tree = cKDTree(self.points) if use_kdtree and cKDTree is not None and len(self.names) else None
+        self.grid = {}
+        if self.tree is None:
+            for i, cell in enumerate(map(tuple, np.floor(self.points / self.cell_size).astype(int))):
+                self.grid.setdefault(cell, []).append(i)
+
+    def query(self, poses, radius):
+        """
+        Objects within radius of any of the poses of a trajectory, i.e. inside its path buffered by radius.
+
+        :param poses: list or array of (x, y) or (x, y, z) poses
+        :param radius: buffer radius
+        :return: set of object names
+        """
+        poses = np.asarray(poses, dtype=float).reshape(len(poses), -1)[:, :2]
+        if not len(poses) or not len(self.names):
+            return set()
+        if self.tree is not None:
+            found = set()
+            for indices in cKDTree(poses).query_ball_tree(self.tree, radius):
+                found.update(indices)
+            return set(self.names[i] for i in found)
+
+        # candidates from the cells the buffered poses overlap, then an exact distance check
+        reach = int(np.ceil(radius / self.cell_size))
+        cells = np.unique(np.floor(poses / self.cell_size).astype(int), axis=0)
+        candidates = set()
+        for cx, cy in cells:
+            for dx in range(-reach, reach + 1):
+                for dy in range(-reach, reach + 1):
+                    candidates.update(self.grid.get((cx + dx, cy + dy), ()))
+        candidates = np.array(sorted(candidates), dtype=int)
+        found = np.zeros(len(candidates), dtype=bool)
+        # chunks of poses keep the distance matrix small for long trajectories
+        for start in range(0, len(poses), 1024):
+            chunk = poses[start:start+1024]
+            d2 = np.sum((self.points[candidates][:, None, :] - chunk[None, :, :])**2, axis=-1)
+            found |= np.any(d2 <= radius**2, axis=1)
+        return set(self.names[i] for i in candidates[found])
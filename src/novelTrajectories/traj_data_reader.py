@@ -3,7 +3,10 @@
 #__author__      = "Paul Duckworth"
 #__copyright__   = "Copyright 2015, University of Leeds"
 from __future__ import print_function
-import rospy
+try:
+    import rospy
+except ImportError:
+    rospy = None
 import timeit
 import ConfigParser
 try:
@@ -15,12 +18,17 @@ import argparse
 import sys
 import os
 import itertools
+import multiprocessing
 import numpy as np
 
 from utilities.utilities import merge_world_qsr_traces
-from qsrlib.qsrlib import QSRlib_Request_Message
+from utilities import qsr_fast_path
 from qsrlib_io.world_trace import Object_State, World_Trace
-from qsrlib_ros.qsrlib_ros_client import QSRlib_ROS_Client
+from qsrlib_io.world_qsr_trace import World_QSR_Trace, QSR
+from qsr_backends import make_backend
+from spatial_index import Objects_Spatial_Index
+from trajectory_simplification import simplify
+from sharded_store import Lazy_Sharded_Dict, save_sharded, load_sharded
 
 options = {"rcc3": "rcc3_rectangle_bounding_boxes_2d",
            "qtcb": "qtc_b_simplified",
@@ -29,6 +37,33 @@ options = {"rcc3": "rcc3_rectangle_bounding_boxes_2d",
            "rcc3a": "rcc3_rectangle_bounding_boxes_2d"}
 
 
+def symmetric_qsr(qsr):
+    return qsr
+
+
+def reverse_qtc(qsr):
+    """
+    QTC of (b, a) from the one of (a, b): the components of the two objects swap, (k, l) -> (l, k) and
+    (k, l, m, n) -> (l, k, n, m).
+    """
+    separator = "," if "," in qsr else ""
+    components = qsr.split(",") if separator else list(qsr)
+    if len(components) == 2:
+        order = (1, 0)
+    elif len(components) == 4:
+        order = (1, 0, 3, 2)
+    else:
+        raise ValueError("not a QTC relation: %s" % qsr)
+    return separator.join(components[i] for i in order)
+
+
+# the relation of (b, a) from the one of (a, b), for the calculi that allow it
+reverse_qsrs = {"rcc3_rectangle_bounding_boxes_2d": symmetric_qsr,
+                "qtc_b_simplified": reverse_qtc,
+                "qtc_c_simplified": reverse_qtc,
+                "qtc_bc_simplified": reverse_qtc}
+
+
 def qsr_setup(data_dir, params, date):
     params_tag = map(str, params)
     params_tag = '__'.join(params_tag)
@@ -41,41 +76,151 @@ def list_condition((item1, item2)):
     return item1 != item2
 
 
+# reader of Trajectory_Data_Reader.apply_qsr_lib_pairwise, inherited by its forked worker processes
+_pairs_worker = {}
+
+
+def _pairs_qsrs(pairs):
+    return pairs, _pairs_worker["reader"].request_pairs_qsrs(pairs)
+
+
+# spatial relations and parameters of Episodes.get_episodes, inherited by its forked worker processes
+_episodes_worker = {}
+
+
+def _trajectory_episodes(uuid):
+    from data_processing_utils import stream_episodes
+
+    qsr_world_trace = _episodes_worker["spatial_relations"][uuid]
+    key, episodes = stream_episodes(uuid, qsr_world_trace, _episodes_worker["noise_thres"],
+                                    _episodes_worker["merge_first"])
+    # the episodes come filtered of the very short transitions that are noise
+    fepi = {}
+    for obj_key, episode in episodes:
+        fepi.setdefault(obj_key, []).append(episode)
+    return uuid, key, fepi
+
+
+
+def object_state_kwargs(params):
+    """
+    The keyword arguments of every Object_State, from the (qsr, q, v, n) params, with q converted from string to float
+    """
+    (qsr, _q,v,n) =  params
+    q = float('0.' + _q.split('_')[1])
+    return dict(quantisation_factor=q, validate=v, no_collapse=n)
+
+
+def object_states(name, poses, frames=None, **kwargs):
+    """
+    The Object_States of a track in bulk, the coordinates of all the poses being converted to floats at once.
+
+    :param poses: (T, 2) or (T, 3) array, or list of poses
+    :param frames: timestamps of the poses, their indices if None
+    :param kwargs: keyword arguments of every Object_State, see object_state_kwargs
+    """
+    poses = np.asarray(poses, dtype=float).reshape(len(poses), -1)
+    if frames is None:
+        frames = range(len(poses))
+    return [Object_State(name=name, timestamp=frame, x=x, y=y, **kwargs)
+            for frame, x, y in itertools.izip(frames, poses[:, 0].tolist(), poses[:, 1].tolist())]
+
+
+def objects_dict(objects):
+    """
+    :param objects: dict of object name -> position, or (names, (N, 2) or (N, 3) array of positions)
+    :return: dict of object name -> [x, y]
+    """
+    if isinstance(objects, tuple):
+        names, positions = objects
+        objects = dict(zip(names, np.asarray(positions, dtype=float).reshape(len(names), -1)[:, :2].tolist()))
+    return objects
+
+
+def same_poses(poses1, poses2):
+    """
+    Whether two dicts of name -> poses (positions or trajectories, as lists or arrays) hold the same poses.
+    """
+    if poses1 is poses2:
+        return True
+    if set(poses1) != set(poses2):
+        return False
+    return all(np.array_equal(np.asarray(poses1[name], dtype=float), np.asarray(poses2[name], dtype=float))
+               for name in poses1)
+
+
+def read_config(config_filename):
+    """
+    :return: the date and the (qsr, q, v, n) params of the trajectory_data_reader section of the config
+    """
+    config_parser = ConfigParser.SafeConfigParser()
+    print(config_parser.read(config_filename))
+
+    if len(config_parser.read(config_filename)) == 0:
+        raise ValueError("Config file not found, please provide a config.ini file as described in the documentation")
+    config_section = "trajectory_data_reader"
+    try:
+        date = config_parser.get(config_section, "date")
+        qsr = config_parser.get(config_section, "qsr")
+        q = config_parser.get(config_section, "q")
+        v = config_parser.get(config_section, "v")
+        n = config_parser.get(config_section, "n")
+    except ConfigParser.NoOptionError:
+        raise
+    return date, (qsr, q, v, n)
+
 
 class Trajectory_Data_Reader(object):
 
-    def __init__(self, objects=[], trajectories=[], config_filename="config.ini"):
-        
+    world_modes = ("pair", "trajectory")
+
+    def __init__(self, objects=[], trajectories=[], config_filename="config.ini", backend="local", batch_size=100,
+                 world_mode="pair", radius=None, simplification=None, processes=1, fast_path=True):
+        """
+        :param objects: dict of object name -> position, or (names, (N, 2) or (N, 3) array of positions)
+        :param trajectories: dict of uuid -> poses, as a list or a (T, 3) array
+        :param backend: "local" for QSRlib in this process, "ros" for the QSRlib ROS service, "ros_concurrent" for
+        concurrent requests to it, or a QSRlib_Backend, see qsr_backends.make_backend
+        :param batch_size: worlds per QSRlib request, one request per world if 1
+        :param world_mode: "pair" for a world per (trajectory, object), "trajectory" for a world per trajectory with
+        all the objects, see get_qsrlib_trajectory_world
+        :param radius: if given, QSRs are only computed for the objects within radius of a trajectory's path; the
+        objects left out of every trajectory are recorded in skipped_objects
+        :param simplification: (method, value) to simplify the trajectories before computing QSRs, see
+        trajectory_simplification.simplify, e.g. ("douglas_peucker", 0.05); the QSRs keep the original frames, the
+        frames kept are recorded in frame_maps
+        :param processes: without trajectories, number of worker processes requesting the QSRs of all the pairs of
+        objects, all cpus if None, see apply_qsr_lib_pairwise
+        :param fast_path: compute the QTC of the trajectories in numpy instead of QSRlib when it is supported, see
+        use_fast_path and test/test_qsr_fast_path.py; False to always use QSRlib
+        """
         print("Initializing Data Reader...")
-        self.list1 = objects
+        self.list1 = objects_dict(objects)
         self.list2 = trajectories
+        self.backend = make_backend(backend)
+        self.batch_size = batch_size
+        if world_mode not in self.world_modes:
+            raise ValueError("unknown world_mode '%s', must be one of %s" % (world_mode, self.world_modes))
+        self.world_mode = world_mode
+        self.radius = radius
+        self.skipped_objects = {}
+        self.objects_index = None
+        self.simplification = simplification
+        self.frame_maps = {}
+        self.processes = processes
+        self.fast_path = fast_path
 
         self.spatial_relations = {}
         self.config = config_filename
 
-        config_parser = ConfigParser.SafeConfigParser()
-        print(config_parser.read(config_filename))
-
-        if len(config_parser.read(config_filename)) == 0:
-            raise ValueError("Config file not found, please provide a config.ini file as described in the documentation")
-        config_section = "trajectory_data_reader"
-        try:
-            self.date = config_parser.get(config_section, "date")
-            qsr = config_parser.get(config_section, "qsr")
-            q = config_parser.get(config_section, "q")
-            v = config_parser.get(config_section, "v")
-            n = config_parser.get(config_section, "n")
-            self.params = (qsr, q, v, n)
-        except ConfigParser.NoOptionError:
-            raise    
+        self.date, self.params = read_config(config_filename)
+        self.state_kwargs = object_state_kwargs(self.params)
         
         if len(self.list1) == 0:
             print("No object list provided. Pass reader to QSR_keeper class.")
         elif len(self.list2) == 0:
             print(" No second list provided.\n All pairwise relations in list 1 being generated...")
-            pairwise_objects = {}
-            for (obj1, obj2) in filter(list_condition, itertools.product(self.list1,    self.list1)):
-                print(obj1, obj2)
+            self.apply_qsr_lib_pairwise()
         else:
             self.apply_qsr_lib()
 
@@ -86,58 +231,276 @@ class Trajectory_Data_Reader(object):
         print("params = ", self.params, '\n')
         self.which_qsr = options[self.params[0]]
 
-        print("Number of qsrlib calls = ", len(trajectories)*len(objects), '\n')
-
+        if self.use_fast_path():
+            self.apply_fast_path(objects, trajectories)
+            return
+        if self.world_mode == "trajectory":
+            self.apply_qsr_lib_trajectory_worlds(objects, trajectories)
+            return
+
+        print("Number of qsrlib worlds = ", len(trajectories)*len(objects), '\n')
+
+        keys, worlds = [], []
+        world_traj_qsrs = {}
+        for n, (uuid, poses) in enumerate(trajectories.items()):
+            kept, frames = self.simplified_poses(uuid, poses)
+            for key, world in self.get_qsrlib_world(uuid, kept, self.nearby_objects(uuid, poses), frames).items():
+                keys.append(key)
+                worlds.append(world)
+            if len(worlds) >= self.batch_size * self.backend.concurrency or n == len(trajectories) - 1:
+                traces = self.backend.request_qsrs_batch(self.which_qsr, worlds, batch_size=self.batch_size)
+                for (traj_uuid, obj), trace in zip(keys, traces):
+                    world_traj_qsrs.setdefault(traj_uuid, []).append(trace)
+                keys, worlds = [], []
+
+        for uuid in trajectories:
+            if uuid in world_traj_qsrs:
+                self.spatial_relations[uuid] = merge_world_qsr_traces(world_traj_qsrs[uuid])
+            else:
+                self.spatial_relations[uuid] = World_QSR_Trace(qsr_type=self.which_qsr)
+        self.report_skipped_objects()
+        self.report_simplification()
+
+
+    def use_fast_path(self):
+        """
+        The fast path computes the QTC of the point tracks, unless validated; RCC3 needs bounding boxes, which the
+        objects and trajectories don't have, and qtc_bc a distance threshold, so both go through QSRlib. Note that the
+        v of the config is a string, hence true even for "False", as QSRlib sees it, so the fast path needs a
+        state_kwargs["validate"] set to False.
+        """
+        return self.fast_path and self.which_qsr in ("qtc_b_simplified", "qtc_c_simplified") and \
+            qsr_fast_path.supported(self.which_qsr, self.state_kwargs["validate"])
+
+
+    def apply_fast_path(self, objects, trajectories):
+        """
+        Same QSRs as apply_qsr_lib, computed with qsr_fast_path: the QTC of a trajectory with all its objects at once.
+        """
+        print("Fast path for %d trajectories" % len(trajectories), '\n')
+        variant = qsr_fast_path.qtc_variants[self.which_qsr]
         for uuid, poses in trajectories.items():
-            world_traj_qsrs = []
-            worlds = self.get_qsrlib_world(uuid, poses, objects)
-            self.spatial_relations[uuid] = {}
-
-            for (uuid, obj), world in worlds.items():
-                qsrlib_request_message = QSRlib_Request_Message(which_qsr=self.which_qsr, \
-                       input_data=world, include_missing_data=True)
-                cln = QSRlib_ROS_Client()
-                req = cln.make_ros_request_message(qsrlib_request_message)
-                res = cln.request_qsrs(req)
-                out = pickle.loads(res.data)
-                world_traj_qsrs.append(out.qsrs)
-            self.spatial_relations[uuid] = merge_world_qsr_traces(world_traj_qsrs)
-
-
-    def get_qsrlib_world(self, uuid, t_poses, objects):
-        o1 = []          #object 1 is always the trajectory
-        o2_dic = {}      #object 2 is always the SOMA object
+            kept, frames = self.simplified_poses(uuid, poses)
+            nearby = self.nearby_objects(uuid, poses)
+            names = sorted(nearby)
+            if not names or not len(kept):
+                self.spatial_relations[uuid] = World_QSR_Trace(qsr_type=self.which_qsr)
+                continue
+            track = np.asarray(kept, dtype=float).reshape(len(kept), -1)[None, :, :2]
+            positions = np.array([nearby[obj][:2] for obj in names], dtype=float)[:, None, :]
+            # QSRlib's pairs are in sorted order, the first object being k
+            first = np.array([obj < "trajectory" for obj in names])[:, None, None]
+            codes, strings = qsr_fast_path.qtc(np.where(first, positions, track), np.where(first, track, positions),
+                                               variant, self.state_kwargs["quantisation_factor"],
+                                               self.state_kwargs["no_collapse"])
+            betweens = ["%s,%s" % tuple(sorted((obj, "trajectory"))) for obj in names]
+            # a world per object keeps no empty states once the traces of the objects are merged
+            self.spatial_relations[uuid] = qsr_fast_path.to_world_qsr_trace(
+                list(frames), betweens, codes, strings, self.which_qsr, self.world_mode == "trajectory")
+        self.report_skipped_objects()
+        self.report_simplification()
+
+
+    def apply_qsr_lib_pairwise(self):
+        """
+        QSRs of all the pairs of objects of list1, e.g. people trajectories, into spatial_relations[name] with the
+        relations of name and every other object, "name,other". Every unordered pair is requested once, in a world of
+        its own, and the relation of the reverse pair is derived from it where the calculus allows it (reverse_qsrs),
+        otherwise both orders are requested in the same world. The worlds are batched batch_size at a time and the
+        batches split among processes worker processes, if more than 1.
+        """
+        print("params = ", self.params, '\n')
+        self.which_qsr = options[self.params[0]]
+        reverse = reverse_qsrs.get(self.which_qsr)
+        pairs = list(itertools.combinations(sorted(self.list1), 2))
+        print("Number of qsrlib worlds = ", len(pairs), '\n')
+
+        size = self.batch_size * self.backend.concurrency
+        chunks = [pairs[i:i+size] for i in range(0, len(pairs), size)]
+        relations = dict((name, World_QSR_Trace(qsr_type=self.which_qsr)) for name in self.list1)
+        _pairs_worker.update(reader=self)
+        pool = None
+        try:
+            if self.processes == 1 or len(chunks) < 2:
+                results = itertools.imap(_pairs_qsrs, chunks)
+            else:
+                # the workers are forked with the reader, only the pairs and their QSRs are pickled
+                pool = multiprocessing.Pool(processes=self.processes)
+                results = pool.imap_unordered(_pairs_qsrs, chunks)
+            for chunk, traces in results:
+                for trace in traces:
+                    for t, state in trace.trace.items():
+                        for between, qsr in state.qsrs.items():
+                            first, second = between.split(",")
+                            relations[first].add_qsr(qsr, t)
+                            if reverse is not None:
+                                relations[second].add_qsr(QSR(t, "%s,%s" % (second, first), reverse(qsr.qsr),
+                                                              qsr.qsr_type), t)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _pairs_worker.clear()
+        self.spatial_relations.update(relations)
+
+
+    def request_pairs_qsrs(self, pairs):
+        """
+        :return: the World_QSR_Trace of every (a, b) pair, with the relations of (b, a) too if they can't be derived
+        """
+        both = self.which_qsr not in reverse_qsrs
+
+        worlds, qsrs_for = [], []
+        for a, b in pairs:
+            world = World_Trace()
+            tracks = [(obj, self.list1[obj]) for obj in (a, b)]
+            # a static object, a single position, is placed at every frame of the other
+            length = max([len(poses) for obj, poses in tracks if np.ndim(poses) == 2] or [1])
+            for obj, poses in tracks:
+                if np.ndim(poses) != 2:
+                    poses = [poses] * length
+                world.add_object_state_series(object_states(obj, poses, **self.state_kwargs))
+            worlds.append(world)
+            qsrs_for.append([(a, b), (b, a)] if both else [(a, b)])
+        return self.backend.request_qsrs_batch(self.which_qsr, worlds, qsrs_for, batch_size=self.batch_size)
+
+
+    def apply_qsr_lib_trajectory_worlds(self, objects, trajectories):
+        print("Number of qsrlib worlds = ", len(trajectories), '\n')
+
+        uuids, worlds, qsrs_for = [], [], []
+        for n, (uuid, poses) in enumerate(trajectories.items()):
+            kept, frames = self.simplified_poses(uuid, poses)
+            world, world_qsrs_for = self.get_qsrlib_trajectory_world(uuid, kept, self.nearby_objects(uuid, poses),
+                                                                     frames)
+            uuids.append(uuid)
+            worlds.append(world)
+            qsrs_for.append(world_qsrs_for)
+            if len(worlds) >= self.batch_size * self.backend.concurrency or n == len(trajectories) - 1:
+                traces = self.backend.request_qsrs_batch(self.which_qsr, worlds, qsrs_for, batch_size=self.batch_size)
+                for traj_uuid, trace in zip(uuids, traces):
+                    self.spatial_relations[traj_uuid] = trace
+                uuids, worlds, qsrs_for = [], [], []
+        self.report_skipped_objects()
+        self.report_simplification()
+
+
+    def nearby_objects(self, uuid, poses):
+        """
+        The objects within self.radius of the trajectory, all of them if no radius is set. The spatial index over the
+        objects is built on first use.
+
+        :return: dict of object name -> position, a subset of self.list1
+        """
+        if self.radius is None:
+            return self.list1
+        if self.objects_index is None:
+            self.objects_index = Objects_Spatial_Index(self.list1, cell_size=self.radius)
+        nearby = self.objects_index.query(poses, self.radius)
+        self.skipped_objects[uuid] = sorted(set(self.list1) - nearby)
+        return dict((obj, self.list1[obj]) for obj in nearby)
+
+
+    def report_skipped_objects(self):
+        if self.radius is None:
+            return
+        skipped = sum(len(objs) for objs in self.skipped_objects.values())
+        print("Skipped %d of %d (trajectory, object) pairs further than %s apart" % \
+              (skipped, len(self.list1)*len(self.list2), self.radius))
+
+
+    def simplified_poses(self, uuid, poses):
+        """
+        :return: the poses kept by the simplification and their original frames, all of them if none is set
+        """
+        if self.simplification is None:
+            return poses, range(len(poses))
+        frames = simplify(poses, *self.simplification)
+        self.frame_maps[uuid] = frames
+        return np.asarray(poses, dtype=float)[frames], frames.tolist()
+
+
+    def report_simplification(self):
+        if self.simplification is None:
+            return
+        kept = sum(len(frames) for frames in self.frame_maps.values())
+        total = sum(len(self.list2[uuid]) for uuid in self.frame_maps)
+        print("Simplification %s kept %d of %d poses" % (self.simplification, kept, total))
+
+
+    def get_qsrlib_world(self, uuid, t_poses, objects, frames=None):
+        """
+        A world per object with the trajectory and the object. The trajectory's Object_States are built in bulk once
+        for all the worlds, and each static object has a single Object_State shared by all the frames.
+
+        :param frames: frames of the poses, their indices if None
+        :return: dict of (uuid, object) -> World_Trace
+        """
         worlds = {}
-        (qsr, _q,v,n) =  self.params
-        q = float('0.' + _q.split('_')[1])  #convert q from string to float
+        o1 = object_states("trajectory", t_poses, frames, **self.state_kwargs)   #object 1 is always the trajectory
 
         for obj in objects:
-            o2_dic[obj] = []
-            key = (uuid, obj)
-            worlds[key] = World_Trace()
+            (x,y) = objects[obj][:2]     #object 2 is always the SOMA object
+            o2 = Object_State(name=obj, timestamp=0, x=x, y=y, **self.state_kwargs)
+            world = World_Trace()
+            world.add_object_state_series(o1)
+            for state in world.trace.values():
+                state.objects[obj] = o2
+            worlds[(uuid, obj)] = world
 
-        for frame, (x,y,z) in enumerate(t_poses):
-            #print(frame, x, y)
-            o1.append(Object_State(name="trajectory", timestamp = frame, x=x, y=y, \
-                    quantisation_factor=q, validate=v, no_collapse=n))
+        return worlds
 
-            for obj in objects:      
-                if len(objects[obj])==2:
-                    (x,y) = objects[obj] 
-                else:
-                    (x,y,z) = objects[obj] 
 
-                o2_dic[obj].append(Object_State(name=obj, timestamp = frame, x=x, y=y, \
-                     quantisation_factor=q, validate=v, no_collapse=n))
+    def get_qsrlib_trajectory_world(self, uuid, t_poses, objects, frames=None):
+        """
+        A single world with the trajectory and all the objects. The objects are static, so each one has a single
+        Object_State shared by all the frames instead of a copy per frame.
 
-        for obj, o2 in o2_dic.items():
-            worlds[(uuid, obj)].add_object_state_series(o1)
-            worlds[(uuid, obj)].add_object_state_series(o2)
+        :param frames: frames of the poses, their indices if None
 
-        return worlds
+        :return: the World_Trace and the (object, trajectory) pairs to request, named in QSRlib's sorted order
+        """
+        world = World_Trace()
 
+        static = {}
+        for obj in objects:
+            (x,y) = objects[obj][:2]
+            static[obj] = Object_State(name=obj, timestamp=0, x=x, y=y, **self.state_kwargs)
 
+        world.add_object_state_series(object_states("trajectory", t_poses, frames, **self.state_kwargs))
+        for state in world.trace.values():
+            state.objects.update(static)
 
+        qsrs_for = [tuple(sorted((obj, "trajectory"))) for obj in objects]
+        return world, qsrs_for
+
+
+
+
+
+def trajectories_meta(spatial_relations):
+    """
+    The trajectory key and relations_digest of every trajectory, kept in the manifest of the QSRs store so that
+    Episodes.get_episodes(incremental=True) only reads the traces it computes episodes of. Only the traces in memory
+    are read, the others keep the ones of the store.
+
+    :param spatial_relations: dict or Lazy_Sharded_Dict of uuid -> World_QSR_Trace
+    :return: dict of "trajectory_keys" and "relations_digests", each by uuid
+    """
+    from data_processing_utils import relations_digest, relations_frames, trajectory_key
+
+    if isinstance(spatial_relations, Lazy_Sharded_Dict):
+        meta = spatial_relations.store.meta
+        keys = dict(meta.get("trajectory_keys", {}))
+        digests = dict(meta.get("relations_digests", {}))
+        in_memory = dict(spatial_relations.loaded)
+        in_memory.update(spatial_relations.updated)
+    else:
+        keys, digests, in_memory = {}, {}, spatial_relations
+    for uuid, qsr_world_trace in in_memory.iteritems():
+        keys[uuid] = trajectory_key(uuid, relations_frames(qsr_world_trace))
+        digests[uuid] = relations_digest(qsr_world_trace)
+    return {"trajectory_keys": keys, "relations_digests": digests}
 
 
 class Trajectory_QSR_Keeper(object):
@@ -157,21 +520,48 @@ class Trajectory_QSR_Keeper(object):
             
             if len(self.list1) == 0:
                 raise TypeError("No object list provided.")
-            elif len(self.list2) == 0:
-                raise TypeError("    No second list provided.\n    All pairwise relations in list 1 being generated...")
-                pairwise_objects = {}
-                for (obj1, obj2) in filter(list_condition, itertools.product(self.list1,    self.list1)):
-                    print(obj1, obj2)
-            else:
-                self.reader = Trajectory_Data_Reader(self.list1, self.list2, reader.config)
-
-
-    def save(self, path):
+            if self.computed_by(reader):
+                print("Reusing the QSRs of the reader")
+                return
+            # without a second list, the reader computes all the pairwise relations in list 1
+            self.reader = Trajectory_Data_Reader(self.list1, self.list2, reader.config,
+                                                 reader.backend, reader.batch_size, reader.world_mode,
+                                                 reader.radius, reader.simplification, reader.processes,
+                                                 reader.fast_path)
+
+
+    def computed_by(self, reader):
+        """
+        Whether the reader already holds the QSRs of the keeper's lists with the params of its config, in which case
+        the keeper takes its spatial_relations, skipped_objects and frame_maps as they are.
+        """
+        if len(reader.list1) == 0:
+            return False
+        _, params = read_config(reader.config)
+        return tuple(reader.params) == params and same_poses(reader.list1, objects_dict(self.list1)) and \
+            same_poses(reader.list2 or {}, self.list2 or {})
+
+
+    def save(self, path, sharded=False, label=None):
+        """
+        :param sharded: save to a sharded store, a directory of shards by uuid prefix with a manifest, instead of one
+        pickle; saving again appends new shards, with only the trajectories added since loading if it was loaded
+        from the same store
+        :param label: with sharded, put all the trajectories in one shard named label (e.g. the date); the manifest
+        also keeps trajectories_meta
+        """
         print("Saving...")
         qsr_dir, tag = qsr_setup(path, self.reader.params, self.reader.date)
-        filename  = os.path.join(qsr_dir, 'all_qsrs_' + tag + '.p')
+        filename  = os.path.join(qsr_dir, 'all_qsrs_' + tag + ('' if sharded else '.p'))
         print(filename)
 
+        if sharded:
+            meta = trajectories_meta(self.reader.spatial_relations)
+            meta["which_qsr"] = self.reader.params
+            save_sharded(self.reader.spatial_relations, filename, label, meta)
+            print("success")
+            return
+
         foo = {"which_qsr": self.reader.params, \
               "world_qsr_traces":self.reader.spatial_relations}
         with open(filename, "wb") as f:
@@ -180,9 +570,20 @@ class Trajectory_QSR_Keeper(object):
 
 
     def load(self, dir, filename):
+        """
+        Loads a pickle, or a sharded store lazily: the QSRs of a trajectory are read when it is accessed.
+        """
         path  = os.path.join(dir, 'qsr_dump/' + filename)
         print("Loading QSRs from", path)
-        
+
+        if os.path.isdir(path):
+            spatial_relations = load_sharded(path)
+            # json gives the params back as a list
+            self.reader.params = tuple(spatial_relations.store.meta["which_qsr"])
+            self.reader.spatial_relations = spatial_relations
+            print("success")
+            return
+
         with open(path, "rb") as f:
             foo = pickle.load(f)
 
@@ -200,51 +601,165 @@ class Episodes(object):
         
         self.reader=reader
         self.all_episodes = {}
+        # fingerprints of the QSRs of the trajectories by key, see get_episodes
+        self.fingerprints = {}
         if load_from_file is not None and load_from_file != "":
             self.load(dir, load_from_file)
 
 
-    def get_episodes(self, noise_thres=3, out=False):
-        from data_processing_utils import  compute_episodes, filter_intervals
-
-        cnt=0
-        NOISE_THRESHOLD = noise_thres
-
-        for (uuid, qsr_world_trace) in self.reader.spatial_relations.items():
-            key, epi  = compute_episodes(uuid, qsr_world_trace)
-            if out: print(cnt, "  ", key)
-            # Filter the episods to remove very short transitions that are noise
-            fepi = {}
-            for e in epi:
-                fepi[e] = filter_intervals(epi[e], NOISE_THRESHOLD)
-
-            # Add filtered episodes to all_episodes
-            self.all_episodes[key] = fepi
-            cnt+=1
-        
-
-    def save(self, data_dir):
+    def get_episodes(self, noise_thres=3, out=False, merge_first=False, processes=1, incremental=False,
+                     fingerprints=False):
+        """
+        :param noise_thres: episodes shorter than this are merged into the previous one
+        :param merge_first: merge a short first episode into the next one instead of dropping it
+        :param processes: number of worker processes computing the episodes of the trajectories, all cpus if None
+        :param incremental: skip the trajectories whose key is in all_episodes already, e.g. loaded from a previous run
+        :param fingerprints: with incremental, skip a trajectory only if the fingerprint of its QSRs and the episodes
+        parameters is the same as the one of its episodes in all_episodes, recomputing the changed ones
+
+        With incremental and QSRs loaded from a sharded store, the keys and digests of trajectories_meta in its
+        manifest tell which trajectories to skip, so only the traces of the others are read.
+        """
+        from data_processing_utils import relations_digest, relations_fingerprint, relations_frames, trajectory_key
+
+        spatial_relations = self.reader.spatial_relations
+        stored_keys, stored_digests, updated = {}, {}, {}
+        if isinstance(spatial_relations, Lazy_Sharded_Dict):
+            # the manifest describes the traces as stored, not the ones set since loading
+            stored_keys = spatial_relations.store.meta.get("trajectory_keys", {})
+            stored_digests = spatial_relations.store.meta.get("relations_digests", {})
+            updated = spatial_relations.updated
+        uuids = []
+        fingerprints_of = {}
+        for uuid in spatial_relations:
+            if incremental:
+                stored = uuid in stored_keys and uuid not in updated
+                key = stored_keys[uuid] if stored else \
+                    trajectory_key(uuid, relations_frames(spatial_relations[uuid]))
+                if fingerprints:
+                    digest = stored_digests.get(uuid) if stored else None
+                    if digest is None:
+                        digest = relations_digest(spatial_relations[uuid])
+                    fingerprints_of[uuid] = relations_fingerprint(None, noise_thres, merge_first, digest=digest)
+                    if self.fingerprints.get(key) == fingerprints_of[uuid]:
+                        continue
+                elif key in self.all_episodes:
+                    continue
+            uuids.append(uuid)
+        if incremental:
+            print("Computing the episodes of %d of %d trajectories" % (len(uuids), len(spatial_relations)))
+
+        _episodes_worker.update(spatial_relations=spatial_relations, noise_thres=noise_thres, merge_first=merge_first)
+        pool = None
+        try:
+            if processes == 1 or len(uuids) < 2:
+                results = itertools.imap(_trajectory_episodes, uuids)
+            else:
+                # the workers are forked with the spatial relations, only the uuids and episodes are pickled
+                pool = multiprocessing.Pool(processes=processes)
+                results = pool.imap_unordered(_trajectory_episodes, uuids, chunksize=max(1, len(uuids) // 256))
+            for cnt, (uuid, key, fepi) in enumerate(results):
+                if out: print(cnt, "  ", key)
+                # Add filtered episodes to all_episodes
+                self.all_episodes[key] = fepi
+                if uuid in fingerprints_of:
+                    self.fingerprints[key] = fingerprints_of[uuid]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _episodes_worker.clear()
+
+
+    def iter_episodes(self, noise_thres=3, merge_first=False):
+        """
+        Same as get_episodes, but the filtered episodes are yielded as they are computed instead of being kept in
+        all_episodes, e.g. to write them straight to storage.
+
+        :return: generator of (trajectory key, pair key, episode)
+        """
+        from data_processing_utils import stream_episodes
+
+        for uuid, qsr_world_trace in self.reader.spatial_relations.iteritems():
+            key, episodes = stream_episodes(uuid, qsr_world_trace, noise_thres, merge_first)
+            for obj_key, episode in episodes:
+                yield key, obj_key, episode
+
+
+    def save(self, data_dir, sharded=False, label=None):
+        """
+        :param sharded: save to the sharded store episodes_dump/all_episodes/ instead of one pickle, see
+        Trajectory_QSR_Keeper.save; the fingerprints are kept in its manifest
+        :param label: with sharded, put all the trajectories in one shard named label (e.g. the date)
+        """
         print("Saving...")
+        if sharded:
+            path = os.path.join(data_dir, 'episodes_dump/all_episodes')
+            print(path)
+            save_sharded(self.all_episodes, path, label, {"fingerprints": self.fingerprints})
+            print("success")
+            return
+
         filename  = os.path.join(data_dir, 'episodes_dump/all_episodes.p')
         print(filename)
 
         with open(filename, "wb") as f:
             pickle.dump(self.all_episodes, f)
+        if self.fingerprints:
+            with open(self.fingerprints_filename(filename), "wb") as f:
+                pickle.dump(self.fingerprints, f)
         print("success")
 
 
     def load(self, dir, filename):
+        """
+        Loads a pickle, or a sharded store lazily: the episodes of a trajectory are read when it is accessed.
+        """
         path  = os.path.join(dir, 'episodes_dump/' + filename)
         print("Loading Episodes from", path)
+        if os.path.isdir(path):
+            self.all_episodes = load_sharded(path)
+            self.fingerprints = dict(self.all_episodes.store.meta.get("fingerprints", {}))
+            print("success")
+            return
         with open(path, "rb") as f:
             self.all_episodes = pickle.load(f)
+        self.fingerprints = {}
+        if os.path.isfile(self.fingerprints_filename(path)):
+            with open(self.fingerprints_filename(path), "rb") as f:
+                self.fingerprints = pickle.load(f)
+        print("success")
+
+
+    def save_db(self, data_dir, filename="all_episodes.db"):
+        """
+        Writes all_episodes to an indexed Episodes_DB, replacing the episodes of the trajectories already in it. To
+        write episodes as they are computed instead: db.insert_episodes(episodes.iter_episodes()).
+        """
+        from episodes_db import Episodes_DB
+
+        print("Saving...")
+        path = os.path.join(data_dir, 'episodes_dump', filename)
+        print(path)
+        db = Episodes_DB(path)
+        try:
+            print("%d episodes" % db.insert_all_episodes(self.all_episodes))
+        finally:
+            db.close()
         print("success")
 
 
+    @staticmethod
+    def fingerprints_filename(filename):
+        # sidecar of an episodes pickle with the fingerprints of its trajectories
+        return os.path.splitext(filename)[0] + '.fingerprints.p'
+
+
 
 
 if __name__ == "__main__":
-    rospy.init_node("trajectory_data_reader")
+    if rospy is not None:
+        rospy.init_node("trajectory_data_reader")
 
     #LOAD SOME DATA#
     data_dir='/home/strands/STRANDS/object_dump'
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""trajectory_simplification.py
+
+Simplification of oversampled trajectories before computing QSRs. Each method returns the indices of the poses kept,
+always including the first and the last one, so the QSRs of the kept poses can be timestamped with their original
+frames.
+"""
+
+from __future__ import print_function
+import numpy as np
+
+
+def decimate(poses, step):
+    """
+    Every step-th pose.
+    """
+    n = len(poses)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    indices = np.arange(0, n, max(1, int(step)))
+    if indices[-1] != n - 1:
+        indices = np.append(indices, n - 1)
+    return indices
+
+
+def resample_distance(poses, distance):
+    """
+    A pose every distance along the path: the first pose of each distance long stretch of the cumulative path length.
+    """
+    poses = np.asarray(poses, dtype=float).reshape(len(poses), -1)[:, :2]
+    n = len(poses)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    length = np.concatenate(([0.], np.cumsum(np.sqrt(np.sum(np.diff(poses, axis=0)**2, axis=1)))))
+    stretch = np.floor(length / distance).astype(int)
+    indices = np.flatnonzero(np.concatenate(([True], stretch[1:] != stretch[:-1])))
+    if indices[-1] != n - 1:
+        indices = np.append(indices, n - 1)
+    return indices
+
+
+def douglas_peucker(poses, epsilon):
+    """
+    Ramer-Douglas-Peucker: the poses kept are such that every pose left out is within epsilon of the segment between
+    the kept poses around it.
+    """
+    poses = np.asarray(poses, dtype=float).reshape(len(poses), -1)[:, :2]
+    n = len(poses)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    # explicit stack instead of recursion, long trajectories would exceed the recursion limit
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = poses[first], poses[last]
+        points = poses[first + 1:last] - start
+        segment = end - start
+        norm2 = segment[0]**2 + segment[1]**2
+        # distance to the segment, not to its line: a trajectory doubling back has poses beyond its ends
+        if norm2 == 0:
+            t = np.zeros(len(points))
+        else:
+            t = np.clip((points[:, 0] * segment[0] + points[:, 1] * segment[1]) / norm2, 0., 1.)
+        distances = np.hypot(points[:, 0] - t * segment[0], points[:, 1] - t * segment[1])
+        i = np.argmax(distances)
+        if distances[i] > epsilon:
+            i += first + 1
+            keep[i] = True
+            stack.append((first, i))
+            stack.append((i, last))
+    return np.flatnonzero(keep)
+
+
+methods = {"decimate": decimate,
+           "distance": resample_distance,
+           "douglas_peucker": douglas_peucker}
+
+
+def simplify(poses, method, value):
+    """
+    :param poses: list or array of (x, y) or (x, y, z) poses
+    :param method: "decimate" (value is the step), "distance" (value is the distance between poses) or
+    "douglas_peucker" (value is the tolerance)
+    :return: indices of the poses kept, i.e. the map from the kept poses to the original frames
+    """
+    if method not in methods:
+        raise ValueError("unknown simplification '%s', must be one of %s" % (method, sorted(methods)))
+    return methods[method](poses, value)
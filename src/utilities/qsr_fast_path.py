@@ -0,0 +1,152 @@
+"""
+Fast path for QSRs of dense array tracks: rcc3_rectangle_bounding_boxes_2d from bounding box arrays and
+qtc_b/c/bc_simplified from point arrays, vectorized in numpy over the frames and the object pairs instead of going
+through QSRlib's per timestamp Object_States. The relations come dictionary encoded: an integer array of codes, -1
+where there is no relation, and the list of the relation strings by code.
+
+test/test_qsr_fast_path.py checks the fast path against QSRlib.
+"""
+
+from __future__ import print_function, division
+import itertools
+import numpy as np
+from qsrlib_io.world_qsr_trace import World_QSR_Trace, World_QSR_State, QSR
+
+rcc3_strings = ["dc", "po", "o"]
+
+qtc_variants = {"qtc_b_simplified": "b",
+                "qtc_c_simplified": "c",
+                "qtc_bc_simplified": "bc"}
+
+
+def qtc_strings(variant):
+    """
+    The QTC relations by code: the components of qtc_b are the 2 first, and the codes of qtc_bc are the 9 qtc_b
+    relations followed by the 81 qtc_c ones.
+    """
+    b = [",".join(s) for s in itertools.product("-0+", repeat=2)]
+    c = [",".join(s) for s in itertools.product("-0+", repeat=4)]
+    return {"b": b, "c": c, "bc": b + c}[variant]
+
+
+def supported(which_qsr, validate=False, distance_threshold=None):
+    """
+    Whether the fast path computes which_qsr the way QSRlib does: not for a validated QTC, which inserts
+    intermediate states, nor for qtc_bc without a distance threshold. validate is tested for truth as QSRlib does, so
+    the "False" string of a config validates.
+    """
+    if which_qsr == "rcc3_rectangle_bounding_boxes_2d":
+        return True
+    if which_qsr in qtc_variants:
+        return not validate and (qtc_variants[which_qsr] != "bc" or distance_threshold is not None)
+    return False
+
+
+def rcc3_rectangle_bounding_boxes_2d(boxes1, boxes2):
+    """
+    :param boxes1: (..., 4) array of (x1, y1, x2, y2) bounding boxes, the minimum and maximum corners
+    :param boxes2: same, broadcastable with boxes1
+    :return: codes into rcc3_strings, and rcc3_strings; a box with a nan coordinate is "dc" of every other
+    """
+    a = np.asarray(boxes1, dtype=float)
+    b = np.asarray(boxes2, dtype=float)
+
+    # boxes of the same centre overlap ("o") if 4 of their corners are inside the other box
+    def corners_inside(p, r):
+        count = 0
+        for x, y in ((p[..., 0], p[..., 1]), (p[..., 2], p[..., 1]), (p[..., 2], p[..., 3]), (p[..., 0], p[..., 3])):
+            count = count + ((x >= r[..., 0]) & (x <= r[..., 2]) & (y >= r[..., 1]) & (y <= r[..., 3]))
+        return count
+
+    with np.errstate(invalid="ignore"):
+        # distance between the centres (times 2) against the sum of the sizes, per axis
+        rabx = np.abs(a[..., 0] + a[..., 2] - b[..., 0] - b[..., 2])
+        raby = np.abs(a[..., 1] + a[..., 3] - b[..., 1] - b[..., 3])
+        raxPrbx = a[..., 2] - a[..., 0] + b[..., 2] - b[..., 0]
+        rayPrby = a[..., 3] - a[..., 1] + b[..., 3] - b[..., 1]
+        intercept = (rabx <= raxPrbx) & (raby <= rayPrby)
+        same_centre = (rabx <= 0) & (raby <= 0)
+        overlap = same_centre & (corners_inside(a, b) + corners_inside(b, a) >= 4)
+
+    codes = np.where(intercept, np.where(overlap, 2, 1), 0)
+    return codes, rcc3_strings
+
+
+def boxes_from_centres(x, y, width, length):
+    """
+    (..., 4) bounding boxes of Object_State like centres and sizes.
+    """
+    x, y, width, length = [np.asarray(v, dtype=float) for v in (x, y, width, length)]
+    return np.stack(np.broadcast_arrays(x - width/2., y - length/2., x + width/2., y + length/2.), axis=-1)
+
+
+def _qtc_symbol(distance, quantisation_factor):
+    # "-" (-1) for a distance beyond the quantisation factor, "+" (1) for one beyond minus it
+    return np.where(distance > quantisation_factor, -1, np.where(distance < -quantisation_factor, 1, 0))
+
+
+def qtc(points1, points2, variant="b", quantisation_factor=0., no_collapse=False, distance_threshold=None):
+    """
+    QTC of two point tracks: the relation of frames t-1 and t is at frame t, so frame 0 has none.
+
+    :param points1: (..., T, 2) array of the (x, y) of the first object, k, e.g. (pairs, frames, 2)
+    :param points2: same for the second object, l, broadcastable with points1
+    :param variant: "b", "c" or "bc"
+    :param quantisation_factor: movements up to it are "0"
+    :param no_collapse: keep the relations equal to the previous one, otherwise only the first of a run is kept;
+    tested for truth as QSRlib does, so the "False" string of a config does not collapse
+    :param distance_threshold: for "bc", the distance of k and l at t-1 up to which the relation is qtc_c
+    :return: (..., T) codes into the strings, and qtc_strings(variant)
+    """
+    if variant == "bc" and distance_threshold is None:
+        raise ValueError("qtc_bc needs a distance_threshold")
+    k, l = np.broadcast_arrays(np.asarray(points1, dtype=float)[..., :2], np.asarray(points2, dtype=float)[..., :2])
+    k0, k1, l0, l1 = k[..., :-1, :], k[..., 1:, :], l[..., :-1, :], l[..., 1:, :]
+    rl = l0 - k0
+    norm = np.hypot(rl[..., 0], rl[..., 1])
+    dk, dl = k1 - k0, l1 - l0
+    # the components of coinciding objects are undefined, as are the ones with missing (nan) positions
+    with np.errstate(invalid="ignore", divide="ignore"):
+        defined = (norm > 0) & np.all(np.isfinite(dk), axis=-1) & np.all(np.isfinite(dl), axis=-1)
+        ux, uy = rl[..., 0] / norm, rl[..., 1] / norm
+        # movement towards the other object along the reference line is "-"
+        components = [_qtc_symbol(dk[..., 0] * ux + dk[..., 1] * uy, quantisation_factor),
+                      _qtc_symbol(-(dl[..., 0] * ux + dl[..., 1] * uy), quantisation_factor)]
+        if variant != "b":
+            # movement to the left of the reference line, seen from the moving object towards the other, is "-"
+            components += [_qtc_symbol(ux * dk[..., 1] - uy * dk[..., 0], quantisation_factor),
+                           _qtc_symbol(-ux * dl[..., 1] + uy * dl[..., 0], quantisation_factor)]
+        digits = [c + 1 for c in components]
+        if variant == "bc":
+            b = 3 * digits[0] + digits[1]
+            c = 27 * digits[0] + 9 * digits[1] + 3 * digits[2] + digits[3]
+            codes = np.where(norm <= distance_threshold, 9 + c, b)
+        else:
+            codes = 0
+            for d in digits:
+                codes = 3 * codes + d
+    codes = np.where(defined, codes, -1)
+    codes = np.concatenate((np.full(codes.shape[:-1] + (1,), -1, dtype=int), codes), axis=-1)
+    if not no_collapse:
+        repeated = (codes[..., 1:] == codes[..., :-1]) & (codes[..., 1:] >= 0)
+        codes[..., 1:][repeated] = -1
+    return codes, qtc_strings(variant)
+
+
+def to_world_qsr_trace(timestamps, betweens, codes, strings, qsr_type, include_missing_data=True):
+    """
+    :param timestamps: T timestamps
+    :param betweens: P "o1,o2" pairs
+    :param codes: (P, T) codes, -1 where there is no relation
+    :param include_missing_data: add an empty state for the timestamps without relations, as QSRlib does
+    :return: World_QSR_Trace
+    """
+    trace = World_QSR_Trace(qsr_type=qsr_type)
+    codes = np.asarray(codes).reshape(len(betweens), len(timestamps))
+    for i, t in enumerate(timestamps):
+        for between, code in zip(betweens, codes[:, i].tolist()):
+            if code >= 0:
+                trace.add_qsr(QSR(t, between, strings[code], qsr_type), t)
+        if include_missing_data and t not in trace.trace:
+            trace.trace[t] = World_QSR_State(timestamp=t)
+    return trace
@@ -2,11 +2,23 @@
 
 from __future__ import print_function
 
-import xml.etree.ElementTree as ET
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 import os
 import csv
 import argparse
 
+
+def save_object_bbox_list_as_csv(bbox, filename):
+    if os.path.exists(filename):
+        print("Warning: file already exists")
+    with open(filename, "wt") as f:
+        w = csv.writer(f)
+        w.writerows(bbox)
+
+
 class Viper_XML_Parser(object):
     def __init__(self, filename, prefix="{http://lamp.cfar.umd.edu/viper#}"):
         self.prefix = prefix
@@ -51,25 +63,122 @@ class Viper_XML_Parser(object):
 
 
     def save_object_bbox_list_as_csv(self, bbox, filename):
-        if os.path.exists(filename):
-            print("Warning: file already exists")
-        with open(filename, "wt") as f:
-            w = csv.writer(f)
-            w.writerows(bbox)
+        save_object_bbox_list_as_csv(bbox, filename)
+
+
+class Viper_XML_Stream_Parser(object):
+    """
+    Same bounding boxes as Viper_XML_Parser, read in a single streaming pass with iterparse instead of loading the
+    whole tree: every object element is dropped from its parent once read, so memory stays flat for long annotation
+    files, and the bounding boxes are kept as their (x, y, width, height, first frame, last frame) spans.
+    """
+    def __init__(self, filename, prefix="{http://lamp.cfar.umd.edu/viper#}"):
+        self.prefix = prefix
+        self.filename = filename
+        self.index = None
+        # whether the index has all the objects of the file
+        self.complete = False
+
+    def iter_objects(self):
+        """
+        :return: generator of (object names, bbox spans) of the objects of the file, in order, the names being all the
+        values of the object's name attribute
+        """
+        object_tag, sourcefile_tag = self.prefix + "object", self.prefix + "sourcefile"
+        sourcefile = None
+        for event, elem in ET.iterparse(self.filename, events=("start", "end")):
+            if event == "start":
+                if elem.tag == sourcefile_tag:
+                    sourcefile = elem
+                continue
+            if elem.tag != object_tag:
+                continue
+            names, spans = [], []
+            for a in elem:
+                if a.attrib.get("name") == "bbox":
+                    spans = self.bbox_etree_to_spans(a)
+                elif a.attrib.get("name") == "name":
+                    names += [v.attrib.get("value") for v in a]
+            yield names, spans
+            if sourcefile is not None:
+                sourcefile.remove(elem)
+            elem.clear()
+
+    def build_index(self, which=None):
+        """
+        Index of object name -> bbox spans of the objects in which, all of them if None, in one pass that stops once
+        they are all found. As find_etree_bbox, an object is found by any of its name values, and the first object of
+        a name is kept; an object with many name values is indexed under each.
+
+        :return: the index, also kept in self.index
+        """
+        wanted = set(which) if which is not None else None
+        index = {}
+        for names, spans in self.iter_objects():
+            for name in names:
+                if name not in index and (wanted is None or name in wanted):
+                    index[name] = spans
+            if wanted is not None and len(index) == len(wanted):
+                break
+        self.index = index
+        self.complete = wanted is None
+        return index
+
+    def find_bbox(self, which):
+        """
+        :return: the bbox spans of the object which, None if it is not in the file; the first call indexes all the
+        objects
+        """
+        if not self.complete and (self.index is None or which not in self.index):
+            self.build_index()
+        return self.index.get(which)
+
+    def bbox_etree_to_spans(self, bbox_etree):
+        spans = []
+        for b in bbox_etree:
+            framespan = [int(foo) for foo in b.attrib["framespan"].split(":")]
+            spans.append((int(b.attrib["x"]), int(b.attrib["y"]), int(b.attrib["width"]), int(b.attrib["height"]),
+                          framespan[0], framespan[1]))
+        return spans
+
+    def bbox_spans_to_list_expanded(self, spans):
+        """
+        Same list as bbox_etree_to_list_expanded: the bbox of every frame.
+        """
+        bbox_list = []
+        for x, y, width, height, first, last in spans:
+            bbox_list += [(x, y, width, height)]*(1 + last - first)
+        return bbox_list
+
+    def save_object_bbox_list_as_csv(self, bbox, filename):
+        save_object_bbox_list_as_csv(bbox, filename)
 
 
 
 if __name__ == '__main__':
     argp = argparse.ArgumentParser(description="From viper xml to csv values")
     argp.add_argument("-i", "--input", help="input xml .xgtf file", required=True)
-    argp.add_argument("-w", "--which", help="which object", required=True)
-    argp.add_argument("-s", "--save", help="save to file")
+    argp.add_argument("-w", "--which", help="which object, can be repeated", action="append")
+    argp.add_argument("-a", "--all", help="all the objects", action="store_true")
+    argp.add_argument("-s", "--save", help="save to file, suffixed by the object name for many objects")
     args = argp.parse_args()
-
-    xmlp = Viper_XML_Parser(args.input)
-    bbox_etree = xmlp.find_etree_bbox(args.which)
-    bbox_list = xmlp.bbox_etree_to_list_expanded(bbox_etree=bbox_etree)
-    if args.save:
-        xmlp.save_object_bbox_list_as_csv(bbox_list, args.save)
+    if not args.which and not args.all:
+        argp.error("provide an object with -w or --all")
+
+    xmlp = Viper_XML_Stream_Parser(args.input)
+    index = xmlp.build_index(None if args.all else args.which)
+    names = sorted(index) if args.all else args.which
+    for name in names:
+        if name not in index:
+            print("Warning: no object %s" % name)
+            continue
+        bbox_list = xmlp.bbox_spans_to_list_expanded(index[name])
+        if args.save:
+            if len(names) == 1:
+                filename = args.save
+            else:
+                root, ext = os.path.splitext(args.save)
+                filename = "%s_%s%s" % (root, name, ext)
+            xmlp.save_object_bbox_list_as_csv(bbox_list, filename)
 
 
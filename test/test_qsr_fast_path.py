@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+Checks that utilities/qsr_fast_path.py gives the QSRs QSRlib gives, with the Object_State arguments the readers
+pass to QSRlib. Skipped without QSRlib.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import itertools
+import unittest
+import numpy as np
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path[:0] = [src, os.path.join(src, "novelTrajectories"), os.path.join(src, "cad120")]
+
+try:
+    from qsrlib.qsrlib import QSRlib, QSRlib_Request_Message
+    from qsrlib_io.world_trace import World_Trace, Object_State
+except ImportError:
+    QSRlib = None
+
+if QSRlib is not None:
+    from utilities import qsr_fast_path
+    from traj_data_reader import Trajectory_Data_Reader, object_state_kwargs
+    from cad120_data_reader import CAD120_Data_Reader
+    from cad120_qsr_keeper import CAD120_QSR_Keeper
+
+
+def dump(world_qsr_trace):
+    return dict((t, dict((k, "%s" % v.qsr) for k, v in s.qsrs.items()))
+                for t, s in world_qsr_trace.trace.items() if s.qsrs)
+
+
+def request(qsrlib, which_qsr, world):
+    return qsrlib.request_qsrs(request_message=QSRlib_Request_Message(
+        which_qsr=which_qsr, input_data=world, include_missing_data=True)).qsrs
+
+
+@unittest.skipIf(QSRlib is None, "QSRlib is not installed")
+class Test_QSR_Fast_Path(unittest.TestCase):
+    runs = 50
+
+    def setUp(self):
+        self.qsrlib = QSRlib()
+        self.rng = np.random.RandomState(0)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def config(self, qsr, q, v, n):
+        filename = os.path.join(self.dir, "config.ini")
+        with open(filename, "w") as f:
+            f.write("[trajectory_data_reader]\ndate = test\nqsr = %s\nq = %s\nv = %s\nn = %s\n" % (qsr, q, v, n))
+        return filename
+
+    def test_config_strings(self):
+        # the v and n of a config are strings, true even when "False", as QSRlib tests them
+        kwargs = object_state_kwargs(("qtcb", "0_01", "False", "False"))
+        self.assertFalse(qsr_fast_path.supported("qtc_b_simplified", kwargs["validate"]))
+        self.assertTrue(qsr_fast_path.supported("qtc_b_simplified", object_state_kwargs(("qtcb", "0_01", "", ""))
+                                                ["validate"]))
+
+    def test_qtc(self):
+        for which_qsr, qsr in (("qtc_b_simplified", "qtcb"), ("qtc_c_simplified", "qtcc")):
+            for run in range(self.runs):
+                frames = self.rng.randint(2, 30)
+                params = (qsr, str(self.rng.choice(["0_0", "0_01", "0_5"])), "",
+                          str(self.rng.choice(["", "True", "False"])))
+                kwargs = object_state_kwargs(params)
+                # steps on a coarse grid, so objects stand still and move along the reference line too
+                tracks = np.cumsum(self.rng.randint(-1, 2, size=(2, frames, 2)), axis=1).astype(float)
+                tracks[1] += 3
+                world = World_Trace()
+                for name, track in zip(("k", "l"), tracks):
+                    for t in range(frames):
+                        world.add_object_state_to_trace(Object_State(name=name, timestamp=t, x=track[t, 0],
+                                                                     y=track[t, 1], **kwargs))
+                codes, strings = qsr_fast_path.qtc(tracks[0], tracks[1], qsr_fast_path.qtc_variants[which_qsr],
+                                                   kwargs["quantisation_factor"], kwargs["no_collapse"])
+                trace = qsr_fast_path.to_world_qsr_trace(range(frames), ["k,l"], codes[None], strings, which_qsr)
+                self.assertEqual(dump(trace), dump(request(self.qsrlib, which_qsr, world)),
+                                 "%s %s differs from QSRlib on run %d" % (which_qsr, params, run))
+
+    def test_reader(self):
+        for qsr in ("qtcb", "qtcc"):
+            for n in ("", "True"):
+                config = self.config(qsr, "0_01", "", n)
+                objects = dict(("O_%d" % i, self.rng.uniform(0, 5, 2).tolist()) for i in range(4))
+                trajectories = dict(("u%d" % i, np.cumsum(self.rng.randint(-1, 2, size=(20, 3)), axis=0) * 0.1)
+                                    for i in range(3))
+                for world_mode in Trajectory_Data_Reader.world_modes:
+                    # the fast path is the default where supported
+                    fast = Trajectory_Data_Reader(objects, trajectories, config, world_mode=world_mode)
+                    self.assertTrue(fast.use_fast_path())
+                    qsrlib = Trajectory_Data_Reader(objects, trajectories, config, world_mode=world_mode,
+                                                    fast_path=False)
+                    self.assertEqual(sorted(fast.spatial_relations), sorted(qsrlib.spatial_relations))
+                    for uuid in trajectories:
+                        self.assertEqual(dump(fast.spatial_relations[uuid]), dump(qsrlib.spatial_relations[uuid]),
+                                         "%s n=%r %s differs from QSRlib for %s" % (qsr, n, world_mode, uuid))
+
+    def test_rcc3(self):
+        which_qsr = "rcc3_rectangle_bounding_boxes_2d"
+        for run in range(self.runs):
+            n, frames = self.rng.randint(2, 5), self.rng.randint(1, 20)
+            # integer centres and sizes, so touching and same centre boxes happen
+            xy = self.rng.randint(0, 6, size=(n, frames, 2)).astype(float)
+            wl = self.rng.randint(1, 4, size=(n, frames, 2)).astype(float)
+            names = ["o%d" % i for i in range(n)]
+            world = World_Trace()
+            for i, name in enumerate(names):
+                for t in range(frames):
+                    world.add_object_state_to_trace(Object_State(name=name, timestamp=t, x=xy[i, t, 0],
+                                                                 y=xy[i, t, 1], width=wl[i, t, 0],
+                                                                 length=wl[i, t, 1]))
+            boxes = qsr_fast_path.boxes_from_centres(xy[..., 0], xy[..., 1], wl[..., 0], wl[..., 1])
+            pairs = list(itertools.combinations(range(n), 2))
+            codes, strings = qsr_fast_path.rcc3_rectangle_bounding_boxes_2d(boxes[[i for i, j in pairs]],
+                                                                            boxes[[j for i, j in pairs]])
+            trace = qsr_fast_path.to_world_qsr_trace(range(frames), ["%s,%s" % (names[i], names[j])
+                                                                     for i, j in pairs], codes, strings, which_qsr)
+            self.assertEqual(dump(trace), dump(request(self.qsrlib, which_qsr, world)),
+                             "rcc3 differs from QSRlib on run %d" % run)
+
+    def cad120_world(self):
+        # objects with bounding boxes and joints without, some missing in some frames
+        world = World_Trace()
+        for t in range(self.rng.randint(1, 15)):
+            for name in ("H", "LH", "RH", "o1", "o2"):
+                if t > 0 and self.rng.rand() < 0.1:
+                    continue
+                x, y = self.rng.randint(0, 6, 2).astype(float)
+                if name.startswith("o"):
+                    width, length = self.rng.randint(1, 4, 2).astype(float)
+                    state = Object_State(name=name, timestamp=t, x=x, y=y, width=width, length=length)
+                else:
+                    state = Object_State(name=name, timestamp=t, x=x, y=y)
+                world.add_object_state_to_trace(state)
+        return world
+
+    def cad120_keeper(self, world_traces):
+        reader = CAD120_Data_Reader.__new__(CAD120_Data_Reader)
+        reader.world_traces = world_traces
+        reader.skeleton_tracks_stale = set()
+        keeper = CAD120_QSR_Keeper.__new__(CAD120_QSR_Keeper)
+        keeper.reader = reader
+        keeper.qsrlib = self.qsrlib
+        keeper.which_qsr = "rcc3_rectangle_bounding_boxes_2d"
+        keeper.world_qsr_traces = {}
+        return keeper
+
+    def test_cad120_rcc3(self):
+        keeper = self.cad120_keeper({})
+        for run in range(self.runs):
+            world = self.cad120_world()
+            self.assertEqual(dump(keeper.rcc3_fast_path(world)), dump(request(self.qsrlib, keeper.which_qsr, world)),
+                             "CAD120 rcc3 differs from QSRlib on run %d" % run)
+
+    def test_cad120_make(self):
+        # the fast path is the default, and both paths keep the response messages of QSRlib
+        world_traces = dict(("episode%d" % i, self.cad120_world()) for i in range(self.runs))
+        fast = self.cad120_keeper(world_traces)
+        fast.make()
+        qsrlib = self.cad120_keeper(world_traces)
+        qsrlib.make(fast_path=False)
+        self.assertEqual(sorted(fast.world_qsr_traces), sorted(world_traces))
+        for k in world_traces:
+            self.assertIs(type(fast.world_qsr_traces[k]), type(qsrlib.world_qsr_traces[k]))
+            self.assertEqual(dump(fast.world_qsr_traces[k].qsrs), dump(qsrlib.world_qsr_traces[k].qsrs),
+                             "CAD120 make differs from QSRlib for %s" % k)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""
+Checks the trajectory simplifications of src/novelTrajectories/trajectory_simplification.py.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import unittest
+import numpy as np
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path[:0] = [os.path.join(src, "novelTrajectories")]
+
+from trajectory_simplification import simplify, douglas_peucker
+
+
+def segment_distance(p, a, b):
+    ab, ap = b - a, p - a
+    t = 0. if not np.any(ab) else min(1., max(0., np.dot(ap, ab) / np.dot(ab, ab)))
+    return np.hypot(*(ap - t * ab))
+
+
+class Test_Trajectory_Simplification(unittest.TestCase):
+    def test_douglas_peucker_doubling_back(self):
+        # out to x=10 and back to x=2: the turning point is 8 away from the segment of the ends
+        poses = [(x, 0.) for x in list(range(11)) + [8, 6, 4, 2]]
+        kept = douglas_peucker(poses, 0.5).tolist()
+        self.assertIn(10, kept)
+        self.assertEqual(kept, [0, 10, 14])
+
+    def test_douglas_peucker_tolerance(self):
+        rng = np.random.RandomState(0)
+        for run in range(20):
+            poses = np.cumsum(rng.randn(rng.randint(3, 200), 2), axis=0)
+            epsilon = rng.uniform(0.1, 3.)
+            kept = douglas_peucker(poses, epsilon)
+            self.assertEqual((kept[0], kept[-1]), (0, len(poses) - 1))
+            # every pose left out is within epsilon of the segment between the kept poses around it
+            for first, last in zip(kept[:-1], kept[1:]):
+                for i in range(first + 1, last):
+                    self.assertLessEqual(segment_distance(poses[i], poses[first], poses[last]), epsilon + 1e-9)
+
+    def test_closed_loop(self):
+        # first and last poses equal: distances to the point
+        poses = [(0., 0.), (1., 0.), (1., 1.), (0., 0.)]
+        self.assertEqual(douglas_peucker(poses, 0.8).tolist(), [0, 2, 3])
+
+    def test_methods(self):
+        poses = [(x, 0., 0.) for x in range(10)]
+        self.assertEqual(simplify(poses, "decimate", 4).tolist(), [0, 4, 8, 9])
+        self.assertEqual(simplify(poses, "distance", 3).tolist(), [0, 3, 6, 9])
+        self.assertEqual(simplify(poses, "douglas_peucker", 0.1).tolist(), [0, 9])
+        self.assertRaises(ValueError, simplify, poses, "unknown", 1)
+
+
+if __name__ == '__main__':
+    unittest.main()